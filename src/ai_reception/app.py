@@ -17,7 +17,7 @@ def run_app():
     try:
         ui = RootUI(root, db)
         ui.pack(fill="both", expand=True)
-        root.protocol("WM_DELETE_WINDOW", lambda: (db.close(), root.destroy()))
+        root.protocol("WM_DELETE_WINDOW", lambda: (ui.close(), db.close(), root.destroy()))
         root.mainloop()
     except Exception as e:
         messagebox.showerror("Error", f"启动失败：\n{e}")
@@ -1,13 +1,29 @@
 from __future__ import annotations
-import sqlite3, json
+import sqlite3, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any
-from .timeutil import now_iso, parse_iso
-
-SCHEMA = """
+from types import MappingProxyType
+from typing import Any, Mapping
+from .timeutil import now_iso
+from . import jsonutil
+
+# page_size only takes effect on a brand-new file, so it must precede journal_mode=WAL.
+# 8 KiB rather than larger: every commit rewrites whole pages into the WAL, and most
+# writes here are single short rows.
+PRAGMAS = """
+PRAGMA page_size=8192;
 PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
 PRAGMA foreign_keys=ON;
+"""
 
+SCHEMA = """
 CREATE TABLE IF NOT EXISTS settings(
   key TEXT PRIMARY KEY,
   value TEXT NOT NULL
@@ -39,6 +55,7 @@ CREATE TABLE IF NOT EXISTS messages(
   FOREIGN KEY(conv_id) REFERENCES conversations(id) ON DELETE CASCADE
 );
 CREATE INDEX IF NOT EXISTS idx_messages_conv_time ON messages(conv_id, time);
+CREATE INDEX IF NOT EXISTS idx_conv_lasttime ON conversations(last_time DESC);
 
 CREATE TABLE IF NOT EXISTS tasks(
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -63,6 +80,11 @@ CREATE UNIQUE INDEX IF NOT EXISTS ux_tasks_staff_start_active
 ON tasks(staff_id, start_time)
 WHERE staff_id IS NOT NULL AND start_time IS NOT NULL AND status IN ('HOLD','CONFIRMED','IN_PROGRESS');
 
+-- list_tasks ordering
+CREATE INDEX IF NOT EXISTS idx_tasks_sort ON tasks(COALESCE(start_time, created_time));
+-- cleanup_expired_holds (runs on every UI tick)
+CREATE INDEX IF NOT EXISTS idx_tasks_hold_expiry ON tasks(hold_expires_at) WHERE status='HOLD';
+
 CREATE TABLE IF NOT EXISTS staff_requests(
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   staff_id INTEGER NOT NULL,
@@ -85,8 +107,77 @@ CREATE TABLE IF NOT EXISTS kb_entries(
   version INTEGER NOT NULL DEFAULT 1,
   updated_time TEXT NOT NULL
 );
+-- KB list order (newest first); the enabled variant serves the KB-context fallback
+CREATE INDEX IF NOT EXISTS idx_kb_updated ON kb_entries(updated_time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_kb_enabled_updated ON kb_entries(enabled, updated_time DESC, id DESC);
+"""
+
+# tasks.end_time is derived from start_time + duration_min so overlap checks can run
+# in SQL; added by _migrate() (ALTER TABLE) so existing databases get it too.
+TASKS_END_TIME_COL = (
+    "end_time TEXT GENERATED ALWAYS AS "
+    "(strftime('%Y-%m-%dT%H:%M:%S', start_time, '+' || duration_min || ' minutes')) VIRTUAL"
+)
+
+# Full-text index over conversations (external content, kept in sync by triggers).
+# trigram tokenizer: substring matching that also works for Chinese text.
+CONV_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS conv_fts USING fts5(
+  phone, display_name, last_message,
+  content='conversations', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN
+  INSERT INTO conv_fts(rowid, phone, display_name, last_message) VALUES(new.id, new.phone, new.display_name, new.last_message);
+END;
+CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN
+  INSERT INTO conv_fts(conv_fts, rowid, phone, display_name, last_message) VALUES('delete', old.id, old.phone, old.display_name, old.last_message);
+END;
+CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF phone, display_name, last_message ON conversations BEGIN
+  INSERT INTO conv_fts(conv_fts, rowid, phone, display_name, last_message) VALUES('delete', old.id, old.phone, old.display_name, old.last_message);
+  INSERT INTO conv_fts(rowid, phone, display_name, last_message) VALUES(new.id, new.phone, new.display_name, new.last_message);
+END;
+"""
+
+KB_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS kb_fts USING fts5(
+  title, content, tags,
+  content='kb_entries', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS kb_entries_fts_ai AFTER INSERT ON kb_entries BEGIN
+  INSERT INTO kb_fts(rowid, title, content, tags) VALUES(new.id, new.title, new.content, new.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS kb_entries_fts_ad AFTER DELETE ON kb_entries BEGIN
+  INSERT INTO kb_fts(kb_fts, rowid, title, content, tags) VALUES('delete', old.id, old.title, old.content, old.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS kb_entries_fts_au AFTER UPDATE OF title, content, tags ON kb_entries BEGIN
+  INSERT INTO kb_fts(kb_fts, rowid, title, content, tags) VALUES('delete', old.id, old.title, old.content, old.tags);
+  INSERT INTO kb_fts(rowid, title, content, tags) VALUES(new.id, new.title, new.content, new.tags);
+END;
 """
 
+def _fts_phrase(q: str) -> str:
+    # quote user input as a single FTS5 phrase (no operators)
+    return '"' + q.replace('"', '""') + '"'
+
+# Hot-path statements (per inbound/outbound message) kept as module constants so
+# every call passes the identical SQL text and hits sqlite3's statement cache.
+SQL_UPSERT_CONVERSATION = (
+    "INSERT INTO conversations(phone,kind,last_time) VALUES(?,?,?) "
+    "ON CONFLICT(phone) DO UPDATE SET kind=excluded.kind, last_time=excluded.last_time RETURNING id"
+)
+SQL_INSERT_MESSAGE = "INSERT INTO messages(conv_id,direction,text,time,meta_json) VALUES(?,?,?,?,?)"
+SQL_TOUCH_CONVERSATION = "UPDATE conversations SET last_message=?, last_time=? WHERE id=?"
+SQL_GET_MESSAGES = (
+    "SELECT id, direction, text, time, meta_json FROM messages "
+    "WHERE conv_id=? AND id>? ORDER BY time ASC, id ASC LIMIT ?"
+)
+STATEMENT_CACHE_SIZE = 512
+# list_kb page size (the KB list loads further pages while scrolling)
+KB_PAGE_SIZE = 200
+
+# timestamp shared by every write inside one DB.batch() (set by the outermost batch)
+_TX_NOW: ContextVar[str | None] = ContextVar("tx_now", default=None)
+
 DEFAULT_SETTINGS = {
     "lang": "zh",
     "sms_mode": "simulator",         # simulator|off (future: android_bridge)
@@ -99,173 +190,366 @@ DEFAULT_SETTINGS = {
     "hold_minutes": "10",
 }
 
+class ReaderPool:
+    """
+    A few extra read-only connections so list_* queries from any thread don't
+    queue behind an in-flight write on the writer connection (WAL allows
+    readers concurrently with one writer).
+    """
+    def __init__(self, path: Path, size: int = 3):
+        self.uri = path.resolve().as_uri() + "?mode=ro"
+        self.size = size
+        self._idle: list[sqlite3.Connection] = []
+
+    def _open(self) -> sqlite3.Connection:
+        c = sqlite3.connect(self.uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        c.row_factory = sqlite3.Row
+        c.executescript("PRAGMA temp_store=MEMORY; PRAGMA cache_size=-65536; PRAGMA mmap_size=268435456;")
+        return c
+
+    @contextmanager
+    def conn(self):
+        try:
+            c = self._idle.pop()
+        except IndexError:
+            c = self._open()
+        try:
+            yield c
+        finally:
+            if len(self._idle) < self.size:
+                self._idle.append(c)
+            else:
+                c.close()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
 class DB:
     def __init__(self, path: Path):
         self.path = path
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.conn = sqlite3.connect(str(path))
+        # shared across the Tk thread and worker threads; writes are serialized by
+        # _write_lock and transactions are explicit (BEGIN in batch()), not implicit
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None,
+                                    cached_statements=STATEMENT_CACHE_SIZE)
         self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(PRAGMAS)
+        self._write_lock = threading.RLock()
+        self._batch_depth = 0
+        self.has_fts = False
+        # change tokens: bumped by every write to the table group, polled by the UI
+        self._versions: dict[str,int] = {"tasks": 0, "convs": 0, "staff": 0, "kb": 0}
         self._init()
+        self._load_staff_phones()
+        self.invalidate_settings()
+        self.readers = ReaderPool(path)
+        # one thread for writes the UI shouldn't wait on; they queue in submission order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+    def submit_write(self, fn, *args) -> Future:
+        """Run a write method (e.g. self.upsert_kb) on the DB's write thread."""
+        return self._writer.submit(fn, *args)
 
     def close(self):
-        try: self.conn.close()
+        try:
+            self._writer.shutdown(wait=True)
+            self.readers.close()
+            # refresh planner statistics for whatever this session queried
+            self.conn.execute("PRAGMA optimize")
+            self.conn.close()
         except Exception: pass
 
+    def _read(self, sql: str, params=()) -> list[sqlite3.Row]:
+        with self.readers.conn() as c:
+            return c.execute(sql, params).fetchall()
+
+    def _read_dicts(self, sql: str, params=()) -> list[dict[str,Any]]:
+        # bulk reads: plain tuples zipped straight into dicts (no Row object per row)
+        with self.readers.conn() as c:
+            cur = c.cursor()
+            cur.row_factory = None
+            cur.execute(sql, params)
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, r)) for r in cur]
+
+    @contextmanager
+    def batch(self):
+        """
+        Group many writes into one transaction (one commit/fsync):
+            with db.batch():
+                for m in msgs: db.add_message(...)
+        """
+        with self._write_lock:
+            self._batch_depth += 1
+            outer = self._batch_depth == 1
+            token = _TX_NOW.set(now_iso()) if outer else None
+            try:
+                if outer:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        yield self
+                    except BaseException:
+                        self.conn.execute("ROLLBACK")
+                        raise
+                    self.conn.execute("COMMIT")
+                else:
+                    yield self
+            finally:
+                self._batch_depth -= 1
+                if token is not None:
+                    _TX_NOW.reset(token)
+
+    def _now(self) -> str:
+        return _TX_NOW.get() or now_iso()
+
+    @contextmanager
+    def _tx(self):
+        # writers use this instead of commit(): joins an outer batch() if active
+        with self.batch():
+            yield
+
     def _init(self):
-        cur = self.conn.cursor()
-        cur.executescript(SCHEMA)
-        self.conn.commit()
-        for k,v in DEFAULT_SETTINGS.items():
-            cur.execute("INSERT OR IGNORE INTO settings(key,value) VALUES(?,?)", (k,v))
-        self.conn.commit()
-
-        # seed staff
-        if self.conn.execute("SELECT COUNT(*) c FROM staff").fetchone()["c"] == 0:
+        # first launch: nothing to lose yet, so skip fsyncs while creating + seeding
+        # (synchronous can't change inside a transaction, hence set around it)
+        fresh = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name='settings'").fetchone() is None
+        if fresh:
+            self.conn.execute("PRAGMA synchronous=OFF")
+        try:
+            self._init_schema()
+        finally:
+            if fresh:
+                self.conn.execute("PRAGMA synchronous=NORMAL")
+        if fresh:
+            # planner statistics for the seeded tables; PRAGMA optimize keeps them fresh later
+            self.conn.execute("ANALYZE")
+
+    def _init_schema(self):
+        # executescript() commits on its own, so DDL runs before the seeding transaction
+        self.conn.executescript(SCHEMA)
+        self.has_fts = self._init_fts("conv_fts", CONV_FTS_SCHEMA) and self._init_fts("kb_fts", KB_FTS_SCHEMA)
+        # one transaction for migration + all seeding (one fsync instead of one per block)
+        with self.batch():
+            self._migrate()
             self.conn.executemany(
-                "INSERT INTO staff(name,phone,active) VALUES(?,?,1)",
-                [("员工A","0211111111"), ("员工B","0222222222"), ("员工C","0233333333")]
+                "INSERT OR IGNORE INTO settings(key,value) VALUES(?,?)",
+                list(DEFAULT_SETTINGS.items()),
             )
-            self.conn.commit()
 
-        # seed KB
-        if self.conn.execute("SELECT COUNT(*) c FROM kb_entries").fetchone()["c"] == 0:
-            self.conn.executemany(
-                "INSERT INTO kb_entries(title,content,tags,enabled,version,updated_time) VALUES(?,?,?,?,?,?)",
-                [
-                    ("欢迎语", "你好，我是接待。请发：时间、地址、联系电话、以及具体要求。", "话术", 1, 1, now_iso()),
-                    ("请假格式", "员工请假短信建议：请假 2025-12-31 10:00-18:00 原因：xxx", "内部", 1, 1, now_iso()),
-                ]
-            )
-            self.conn.commit()
+            # seed staff
+            if self.conn.execute("SELECT COUNT(*) c FROM staff").fetchone()["c"] == 0:
+                self.conn.executemany(
+                    "INSERT INTO staff(name,phone,active) VALUES(?,?,1)",
+                    [("员工A","0211111111"), ("员工B","0222222222"), ("员工C","0233333333")]
+                )
+
+            # seed KB
+            if self.conn.execute("SELECT COUNT(*) c FROM kb_entries").fetchone()["c"] == 0:
+                now = self._now()
+                self.conn.executemany(
+                    "INSERT INTO kb_entries(title,content,tags,enabled,version,updated_time) VALUES(?,?,?,?,?,?)",
+                    [
+                        ("欢迎语", "你好，我是接待。请发：时间、地址、联系电话、以及具体要求。", "话术", 1, 1, now),
+                        ("请假格式", "员工请假短信建议：请假 2025-12-31 10:00-18:00 原因：xxx", "内部", 1, 1, now),
+                    ]
+                )
+
+    def _migrate(self):
+        cols = {r["name"] for r in self.conn.execute("PRAGMA table_xinfo(tasks)")}
+        if "end_time" not in cols:
+            self.conn.execute(f"ALTER TABLE tasks ADD COLUMN {TASKS_END_TIME_COL}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_staff_status ON tasks(staff_id, status, start_time, end_time)")
+
+    def _init_fts(self, table: str, script: str) -> bool:
+        # FTS5 is optional in some SQLite builds: fall back to LIKE scans without it
+        existed = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (table,)).fetchone()
+        try:
+            self.conn.executescript(script)
+        except sqlite3.OperationalError:
+            return False
+        if not existed:
+            self.conn.execute(f"INSERT INTO {table}({table}) VALUES('rebuild')")
+        return True
+
+    # change tokens
+    def _bump(self, name: str):
+        self._versions[name] += 1
+
+    def tasks_version(self) -> int:
+        return self._versions["tasks"]
+
+    def convs_version(self) -> int:
+        return self._versions["convs"]
+
+    def staff_version(self) -> int:
+        return self._versions["staff"]
+
+    def kb_version(self) -> int:
+        return self._versions["kb"]
 
     # settings
+    # settings are tiny and rarely written: serve reads from memory
+    def invalidate_settings(self):
+        # the writer connection is shared with the db-write thread: only read it between
+        # transactions, never in the middle of one (uncommitted rows, interleaved cursors)
+        with self._write_lock:
+            rows = self.conn.execute("SELECT key,value FROM settings").fetchall()
+        self._settings_cache: dict[str,str] = {r["key"]: r["value"] for r in rows}
+        self._settings_view = MappingProxyType(self._settings_cache)
+
     def get_setting(self, key: str) -> str:
-        r = self.conn.execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
-        return r["value"] if r else ""
+        return self._settings_cache.get(key, "")
 
     def set_setting(self, key: str, value: str):
-        self.conn.execute(
-            "INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, value),
-        )
-        self.conn.commit()
+        self.set_settings({key: value})
+
+    def set_settings(self, mapping: dict[str,str]):
+        # all keys in one transaction (one commit for the whole settings form)
+        with self._tx():
+            self.conn.executemany(
+                "INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                list(mapping.items()),
+            )
+        self._settings_cache.update(mapping)
 
-    def get_settings(self) -> dict[str,str]:
-        rows = self.conn.execute("SELECT key,value FROM settings").fetchall()
-        return {r["key"]: r["value"] for r in rows}
+    def get_settings(self) -> Mapping[str,str]:
+        # read-only live view of the cache: no copy per call, and callers can't bypass set_settings
+        return self._settings_view
 
     # staff
     def list_staff(self, include_inactive=True):
         if include_inactive:
-            rows = self.conn.execute("SELECT * FROM staff ORDER BY active DESC, id ASC").fetchall()
+            return self._read_dicts("SELECT * FROM staff ORDER BY active DESC, id ASC")
         else:
-            rows = self.conn.execute("SELECT * FROM staff WHERE active=1 ORDER BY id ASC").fetchall()
-        return [dict(r) for r in rows]
+            return self._read_dicts("SELECT * FROM staff WHERE active=1 ORDER BY id ASC")
 
     def upsert_staff(self, staff_id: int|None, name: str, phone: str, active: int):
         name, phone = name.strip(), phone.strip()
         cur = self.conn.cursor()
-        if staff_id:
-            cur.execute("UPDATE staff SET name=?, phone=?, active=? WHERE id=?", (name, phone, active, staff_id))
-            sid = staff_id
-        else:
-            cur.execute("INSERT INTO staff(name,phone,active) VALUES(?,?,?)", (name, phone, active))
-            sid = int(cur.lastrowid)
-        self.conn.commit()
+        with self._tx():
+            if staff_id:
+                cur.execute("UPDATE staff SET name=?, phone=?, active=? WHERE id=?", (name, phone, active, staff_id))
+                sid = staff_id
+            else:
+                cur.execute("INSERT INTO staff(name,phone,active) VALUES(?,?,?)", (name, phone, active))
+                sid = int(cur.lastrowid)
+            self._bump("staff")
+        self._load_staff_phones()
         return int(sid)
 
     def delete_staff(self, staff_id: int):
-        self.conn.execute("DELETE FROM staff WHERE id=?", (staff_id,))
-        self.conn.commit()
+        with self._tx():
+            self.conn.execute("DELETE FROM staff WHERE id=?", (staff_id,))
+            # ON DELETE SET NULL / CASCADE rewrites tasks and staff_requests too
+            self._bump("staff")
+            self._bump("tasks")
+        self._load_staff_phones()
+
+    def _load_staff_phones(self):
+        # phone -> staff id, kept in memory so the per-message path needs no SELECT
+        with self._write_lock:  # see invalidate_settings()
+            rows = self.conn.execute("SELECT id, phone FROM staff").fetchall()
+        self._staff_phones: dict[str,int] = {r["phone"]: int(r["id"]) for r in rows}
 
     def is_staff_phone(self, phone: str) -> tuple[bool, int|None]:
-        r = self.conn.execute("SELECT id FROM staff WHERE phone=?", (phone.strip(),)).fetchone()
-        return (True, int(r["id"])) if r else (False, None)
+        sid = self._staff_phones.get(phone.strip())
+        return (True, sid) if sid is not None else (False, None)
 
     # conversations / messages
     def upsert_conversation(self, phone: str) -> int:
         phone = phone.strip()
         is_staff, _ = self.is_staff_phone(phone)
         kind = "staff" if is_staff else "customer"
-        self.conn.execute("INSERT OR IGNORE INTO conversations(phone,kind,last_time) VALUES(?,?,?)", (phone, kind, now_iso()))
-        self.conn.execute("UPDATE conversations SET kind=?, last_time=? WHERE phone=?", (kind, now_iso(), phone))
-        self.conn.commit()
-        r = self.conn.execute("SELECT id FROM conversations WHERE phone=?", (phone,)).fetchone()
+        with self._tx():
+            r = self.conn.execute(SQL_UPSERT_CONVERSATION, (phone, kind, self._now())).fetchone()
+            self._bump("convs")
         return int(r["id"])
 
     def set_conversation_kind(self, phone: str, kind: str):
-        self.conn.execute("UPDATE conversations SET kind=? WHERE phone=?", (kind, phone.strip()))
-        self.conn.commit()
+        with self._tx():
+            self.conn.execute("UPDATE conversations SET kind=? WHERE phone=?", (kind, phone.strip()))
+            self._bump("convs")
 
     def add_message(self, phone: str, direction: str, text: str, meta: dict[str,Any] | None=None) -> int:
-        conv_id = self.upsert_conversation(phone)
-        meta_json = json.dumps(meta or {}, ensure_ascii=False)
-        t = now_iso()
+        meta_json = jsonutil.dumps(meta or {})
         cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO messages(conv_id,direction,text,time,meta_json) VALUES(?,?,?,?,?)",
-            (conv_id, direction, text, t, meta_json),
-        )
-        self.conn.execute("UPDATE conversations SET last_message=?, last_time=? WHERE id=?", (text[:120], t, conv_id))
-        self.conn.commit()
+        # conversation upsert + insert + last_message update share one transaction
+        with self.batch():
+            conv_id = self.upsert_conversation(phone)
+            t = self._now()
+            cur.execute(SQL_INSERT_MESSAGE, (conv_id, direction, text, t, meta_json))
+            self.conn.execute(SQL_TOUCH_CONVERSATION, (text[:120], t, conv_id))
         return int(cur.lastrowid)
 
     def list_conversations(self, q: str="", kind_filter: str="all") -> list[dict[str,Any]]:
         q = q.strip()
         where, params = [], []
         if kind_filter in ("customer","staff"):
-            where.append("kind=?")
+            where.append("c.kind=?")
             params.append(kind_filter)
-        if q:
+        cols = "c.id, c.phone, c.kind, c.display_name, c.last_message, c.last_time"
+        sql = f"SELECT {cols} FROM conversations c"
+        if q and self.has_fts and len(q) >= 3:
+            # trigram index needs >= 3 chars; shorter queries fall back to LIKE
+            sql = f"SELECT {cols} FROM conv_fts JOIN conversations c ON c.id=conv_fts.rowid"
+            where.insert(0, "conv_fts MATCH ?")
+            params.insert(0, _fts_phrase(q))
+        elif q:
             like = f"%{q}%"
-            where.append("(phone LIKE ? OR display_name LIKE ? OR last_message LIKE ?)")
+            where.append("(c.phone LIKE ? OR c.display_name LIKE ? OR c.last_message LIKE ?)")
             params.extend([like, like, like])
-        sql = "SELECT * FROM conversations"
         if where:
             sql += " WHERE " + " AND ".join(where)
-        sql += " ORDER BY last_time DESC LIMIT 300"
-        rows = self.conn.execute(sql, params).fetchall()
-        return [dict(r) for r in rows]
+        sql += " ORDER BY c.last_time DESC LIMIT 300"
+        return self._read_dicts(sql, params)
 
-    def get_messages(self, conv_id: int, limit: int=400):
-        rows = self.conn.execute(
-            "SELECT * FROM messages WHERE conv_id=? ORDER BY time ASC LIMIT ?",
-            (conv_id, limit),
-        ).fetchall()
-        return [dict(r) for r in rows]
+    def get_messages(self, conv_id: int, limit: int=400, after_id: int=0):
+        # after_id: keyset paging, fetch only messages newer than the last one shown.
+        # meta_json is parsed here, once per row, into m["meta"] (the chat view renders SMS status from it)
+        rows = self._read_dicts(SQL_GET_MESSAGES, (conv_id, after_id, limit))
+        for r in rows:
+            raw = r.pop("meta_json")
+            try: r["meta"] = jsonutil.loads(raw) if raw and raw != "{}" else {}
+            except ValueError: r["meta"] = {}
+        return rows
+
+    def get_message_meta(self, msg_id: int) -> str:
+        rows = self._read("SELECT meta_json FROM messages WHERE id=?", (msg_id,))
+        return rows[0]["meta_json"] if rows else "{}"
 
     def get_conversation(self, conv_id: int):
-        r = self.conn.execute("SELECT * FROM conversations WHERE id=?", (conv_id,)).fetchone()
-        return dict(r) if r else None
+        rows = self._read("SELECT * FROM conversations WHERE id=?", (conv_id,))
+        return dict(rows[0]) if rows else None
 
     # tasks
     def get_active_task_for_conv(self, conv_id: int):
-        r = self.conn.execute(
+        rows = self._read(
             "SELECT * FROM tasks WHERE conv_id=? AND status IN ('TODO','HOLD','CONFIRMED','IN_PROGRESS') ORDER BY id DESC LIMIT 1",
             (conv_id,),
-        ).fetchone()
-        return dict(r) if r else None
+        )
+        return dict(rows[0]) if rows else None
 
     def create_or_update_task(self, conv_id: int, extracted: dict[str,Any]) -> int:
-        row = self.conn.execute(
-            "SELECT id FROM tasks WHERE conv_id=? AND status IN ('TODO','HOLD','CONFIRMED','IN_PROGRESS') ORDER BY id DESC LIMIT 1",
-            (conv_id,),
-        ).fetchone()
-        now = now_iso()
-        if row:
-            tid = int(row["id"])
-            self.conn.execute(
-                "UPDATE tasks SET title=?, address=?, contact_phone=?, notes=?, updated_time=? WHERE id=?",
-                (extracted.get("title",""), extracted.get("address",""), extracted.get("contact_phone",""), extracted.get("notes",""), now, tid),
-            )
-        else:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO tasks(conv_id,title,address,contact_phone,notes,status,created_time,updated_time) VALUES(?,?,?,?,?,'TODO',?,?)",
-                (conv_id, extracted.get("title",""), extracted.get("address",""), extracted.get("contact_phone",""), extracted.get("notes",""), now, now),
-            )
-            tid = int(cur.lastrowid)
-        self.conn.commit()
+        now = self._now()
+        with self._tx():
+            row = self.conn.execute(
+                "SELECT id FROM tasks WHERE conv_id=? AND status IN ('TODO','HOLD','CONFIRMED','IN_PROGRESS') ORDER BY id DESC LIMIT 1",
+                (conv_id,),
+            ).fetchone()
+            if row:
+                tid = int(row["id"])
+                self.conn.execute(
+                    "UPDATE tasks SET title=?, address=?, contact_phone=?, notes=?, updated_time=? WHERE id=?",
+                    (extracted.get("title",""), extracted.get("address",""), extracted.get("contact_phone",""), extracted.get("notes",""), now, tid),
+                )
+            else:
+                cur = self.conn.cursor()
+                cur.execute(
+                    "INSERT INTO tasks(conv_id,title,address,contact_phone,notes,status,created_time,updated_time) VALUES(?,?,?,?,?,'TODO',?,?)",
+                    (conv_id, extracted.get("title",""), extracted.get("address",""), extracted.get("contact_phone",""), extracted.get("notes",""), now, now),
+                )
+                tid = int(cur.lastrowid)
+            self._bump("tasks")
         return int(tid)
 
     def list_tasks(self, date_prefix: str="", staff_id: int|None=None, status: str="") -> list[dict[str,Any]]:
@@ -279,36 +563,23 @@ class DB:
         if status:
             where.append("status=?")
             params.append(status)
-        sql = "SELECT * FROM tasks"
+        sql = "SELECT id, conv_id, title, start_time, end_time, duration_min, staff_id, status FROM tasks"
         if where:
             sql += " WHERE " + " AND ".join(where)
         sql += " ORDER BY COALESCE(start_time, created_time) ASC LIMIT 500"
-        rows = self.conn.execute(sql, params).fetchall()
-        return [dict(r) for r in rows]
+        return self._read_dicts(sql, params)
 
     def _overlap_conflict(self, staff_id: int, start_time: str, end_time: str) -> bool:
-        # Check overlapping intervals with active tasks
-        rows = self.conn.execute(
-            "SELECT start_time, duration_min FROM tasks WHERE staff_id=? AND status IN ('HOLD','CONFIRMED','IN_PROGRESS') AND start_time IS NOT NULL",
-            (staff_id,),
-        ).fetchall()
-        s_new = parse_iso(start_time)
-        e_new = parse_iso(end_time)
-        if not s_new or not e_new:
-            return False
-        from datetime import timedelta
-        for r in rows:
-            s = parse_iso(r["start_time"])
-            if not s:
-                continue
-            e = s + timedelta(minutes=int(r["duration_min"] or 60))
-            if max(s, s_new) < min(e, e_new):
-                return True
-        return False
+        # Check overlapping intervals with active tasks (ISO strings compare lexicographically)
+        r = self.conn.execute(
+            "SELECT 1 FROM tasks WHERE staff_id=? AND status IN ('HOLD','CONFIRMED','IN_PROGRESS') "
+            "AND start_time < ? AND end_time > ? LIMIT 1",
+            (staff_id, end_time, start_time),
+        ).fetchone()
+        return r is not None
 
     def assign_hold(self, task_id: int, staff_id: int, start_time: str, duration_min: int, hold_minutes: int):
-        from datetime import datetime, timedelta
-        now = now_iso()
+        now = self._now()
         # compute end_time
         try:
             sdt = datetime.fromisoformat(start_time)
@@ -316,108 +587,135 @@ class DB:
             return False, "时间格式不对"
         end_time = (sdt + timedelta(minutes=duration_min)).isoformat(timespec="seconds")
 
-        if self._overlap_conflict(staff_id, start_time, end_time):
-            return False, "冲突：该员工该时间段已被占用"
-
+        expires = (datetime.now() + timedelta(minutes=hold_minutes)).isoformat(timespec="seconds")
         try:
-            expires = (datetime.fromisoformat(now) + timedelta(minutes=hold_minutes)).isoformat(timespec="seconds")
-        except Exception:
-            expires = now
-        try:
-            self.conn.execute(
-                "UPDATE tasks SET staff_id=?, start_time=?, duration_min=?, status='HOLD', hold_expires_at=?, updated_time=? WHERE id=?",
-                (staff_id, start_time, duration_min, expires, now, task_id),
-            )
-            self.conn.commit()
+            # check + claim in one write transaction so two threads can't both win the slot
+            with self._tx():
+                if self._overlap_conflict(staff_id, start_time, end_time):
+                    return False, "冲突：该员工该时间段已被占用"
+                self.conn.execute(
+                    "UPDATE tasks SET staff_id=?, start_time=?, duration_min=?, status='HOLD', hold_expires_at=?, updated_time=? WHERE id=?",
+                    (staff_id, start_time, duration_min, expires, now, task_id),
+                )
+                self._bump("tasks")
             return True, "已临时占用（HOLD）"
         except sqlite3.IntegrityError:
             return False, "冲突：该员工该开始时间已被占用"
 
     def confirm_task(self, task_id: int):
-        self.conn.execute("UPDATE tasks SET status='CONFIRMED', hold_expires_at=NULL, updated_time=? WHERE id=?", (now_iso(), task_id))
-        self.conn.commit()
+        with self._tx():
+            self.conn.execute("UPDATE tasks SET status='CONFIRMED', hold_expires_at=NULL, updated_time=? WHERE id=?", (self._now(), task_id))
+            self._bump("tasks")
 
     def mark_done(self, task_id: int):
-        self.conn.execute("UPDATE tasks SET status='DONE', updated_time=? WHERE id=?", (now_iso(), task_id))
-        self.conn.commit()
+        with self._tx():
+            self.conn.execute("UPDATE tasks SET status='DONE', updated_time=? WHERE id=?", (self._now(), task_id))
+            self._bump("tasks")
 
     def cancel_task(self, task_id: int):
-        self.conn.execute("UPDATE tasks SET status='CANCELLED', updated_time=? WHERE id=?", (now_iso(), task_id))
-        self.conn.commit()
+        with self._tx():
+            self.conn.execute("UPDATE tasks SET status='CANCELLED', updated_time=? WHERE id=?", (self._now(), task_id))
+            self._bump("tasks")
 
     def cleanup_expired_holds(self) -> int:
-        rows = self.conn.execute("SELECT id, hold_expires_at FROM tasks WHERE status='HOLD' AND hold_expires_at IS NOT NULL").fetchall()
-        now = parse_iso(now_iso())
-        expired = []
-        for r in rows:
-            dt = parse_iso(r["hold_expires_at"])
-            if dt and now and dt <= now:
-                expired.append(int(r["id"]))
-        if not expired:
-            return 0
-        self.conn.executemany(
-            "UPDATE tasks SET status='EXPIRED', staff_id=NULL, start_time=NULL, hold_expires_at=NULL, updated_time=? WHERE id=?",
-            [(now_iso(), tid) for tid in expired],
-        )
-        self.conn.commit()
-        return len(expired)
+        # zero-padded ISO strings compare correctly as text: no Python date parsing needed
+        now = self._now()
+        with self._tx():
+            rows = self.conn.execute(
+                "UPDATE tasks SET status='EXPIRED', staff_id=NULL, start_time=NULL, hold_expires_at=NULL, updated_time=? "
+                "WHERE status='HOLD' AND hold_expires_at IS NOT NULL AND hold_expires_at <= ? RETURNING id",
+                (now, now),
+            ).fetchall()
+            if rows:
+                self._bump("tasks")
+        return len(rows)
 
     # staff requests (leave)
     def create_staff_request(self, staff_id: int, content: str, start_time: str|None, end_time: str|None) -> int:
-        now = now_iso()
+        now = self._now()
         cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO staff_requests(staff_id,type,content,start_time,end_time,status,created_time,updated_time) VALUES(?,?,?,?,?,'PENDING',?,?)",
-            (staff_id, "leave", content, start_time, end_time, now, now),
-        )
-        self.conn.commit()
+        with self._tx():
+            cur.execute(
+                "INSERT INTO staff_requests(staff_id,type,content,start_time,end_time,status,created_time,updated_time) VALUES(?,?,?,?,?,'PENDING',?,?)",
+                (staff_id, "leave", content, start_time, end_time, now, now),
+            )
         return int(cur.lastrowid)
 
     def list_staff_requests(self, status: str="") -> list[dict[str,Any]]:
         if status:
-            rows = self.conn.execute("SELECT * FROM staff_requests WHERE status=? ORDER BY created_time DESC LIMIT 500", (status,)).fetchall()
+            return self._read_dicts("SELECT * FROM staff_requests WHERE status=? ORDER BY created_time DESC LIMIT 500", (status,))
         else:
-            rows = self.conn.execute("SELECT * FROM staff_requests ORDER BY created_time DESC LIMIT 500").fetchall()
-        return [dict(r) for r in rows]
+            return self._read_dicts("SELECT * FROM staff_requests ORDER BY created_time DESC LIMIT 500")
 
     def update_staff_request_status(self, req_id: int, status: str):
-        self.conn.execute("UPDATE staff_requests SET status=?, updated_time=? WHERE id=?", (status, now_iso(), req_id))
-        self.conn.commit()
+        with self._tx():
+            self.conn.execute("UPDATE staff_requests SET status=?, updated_time=? WHERE id=?", (status, self._now(), req_id))
 
     # KB
-    def list_kb(self, q: str="") -> list[dict[str,Any]]:
+    def list_kb(self, q: str="", limit: int=KB_PAGE_SIZE, offset: int=0, enabled_only: bool=False) -> list[dict[str,Any]]:
         q = q.strip()
-        where, params = [], []
+        terms = q.split()
+        if terms and self.has_fts and all(len(t) >= 3 for t in terms):
+            # every whitespace-separated term must match (trigram index: substring semantics, >= 3 chars)
+            return self._read_dicts(
+                "SELECT e.*, CASE e.enabled WHEN 0 THEN '' ELSE '✓' END AS flag "
+                "FROM kb_fts JOIN kb_entries e ON e.id=kb_fts.rowid "
+                f"WHERE kb_fts MATCH ?{' AND e.enabled=1' if enabled_only else ''} "
+                "ORDER BY bm25(kb_fts), e.updated_time DESC, e.id LIMIT ? OFFSET ?",
+                (" AND ".join(_fts_phrase(t) for t in terms), limit, offset),
+            )
+        where, params = ["enabled=1"] if enabled_only else [], []
         if q:
             like = f"%{q}%"
             where.append("(title LIKE ? OR content LIKE ? OR tags LIKE ?)")
             params.extend([like, like, like])
-        sql = "SELECT * FROM kb_entries"
+        # the enabled-column text is built here so the UI doesn't format every row itself
+        sql = "SELECT *, CASE enabled WHEN 0 THEN '' ELSE '✓' END AS flag FROM kb_entries"
         if where:
             sql += " WHERE " + " AND ".join(where)
-        sql += " ORDER BY updated_time DESC LIMIT 500"
-        rows = self.conn.execute(sql, params).fetchall()
-        return [dict(r) for r in rows]
+        # id breaks ties so OFFSET pages never overlap or skip rows
+        sql += " ORDER BY updated_time DESC, id DESC LIMIT ? OFFSET ?"
+        return self._read_dicts(sql, params + [limit, offset])
+
+    def search_kb(self, keywords: list[str], limit: int=4) -> list[dict[str,Any]] | None:
+        """
+        Top enabled KB rows for any of the keywords, ranked by FTS5 bm25.
+        Returns None when FTS can't fully answer so callers can fall back:
+        no FTS5, or any keyword shorter than the trigram minimum of 3 chars
+        (common for 2-char Chinese words). A real miss is [] - the Python
+        scorer uses the same substring test, so it couldn't find more.
+        """
+        terms = [k for k in keywords if len(k) >= 3]
+        if not self.has_fts or not terms or len(terms) < len(keywords):
+            return None
+        rows = self._read_dicts(
+            "SELECT e.* FROM kb_fts JOIN kb_entries e ON e.id=kb_fts.rowid "
+            "WHERE kb_fts MATCH ? AND e.enabled=1 ORDER BY bm25(kb_fts), e.updated_time LIMIT ?",
+            (" OR ".join(_fts_phrase(k) for k in terms), limit),
+        )
+        return rows
 
     def upsert_kb(self, kb_id: int|None, title: str, content: str, tags: str, enabled: int) -> int:
         title, content, tags = title.strip(), content.strip(), tags.strip()
-        now = now_iso()
+        now = self._now()
         cur = self.conn.cursor()
-        if kb_id:
-            cur.execute(
-                "UPDATE kb_entries SET title=?, content=?, tags=?, enabled=?, version=version+1, updated_time=? WHERE id=?",
-                (title, content, tags, enabled, now, kb_id),
-            )
-            kid = kb_id
-        else:
-            cur.execute(
-                "INSERT INTO kb_entries(title,content,tags,enabled,version,updated_time) VALUES(?,?,?,?,?,?)",
-                (title, content, tags, enabled, 1, now),
-            )
-            kid = int(cur.lastrowid)
-        self.conn.commit()
+        with self._tx():
+            if kb_id:
+                cur.execute(
+                    "UPDATE kb_entries SET title=?, content=?, tags=?, enabled=?, version=version+1, updated_time=? WHERE id=?",
+                    (title, content, tags, enabled, now, kb_id),
+                )
+                kid = kb_id
+            else:
+                cur.execute(
+                    "INSERT INTO kb_entries(title,content,tags,enabled,version,updated_time) VALUES(?,?,?,?,?,?)",
+                    (title, content, tags, enabled, 1, now),
+                )
+                kid = int(cur.lastrowid)
+            self._bump("kb")
         return int(kid)
 
     def delete_kb(self, kb_id: int):
-        self.conn.execute("DELETE FROM kb_entries WHERE id=?", (kb_id,))
-        self.conn.commit()
+        with self._tx():
+            self.conn.execute("DELETE FROM kb_entries WHERE id=?", (kb_id,))
+            self._bump("kb")
@@ -3,19 +3,27 @@ import re
 from datetime import datetime
 
 PHONE_RE = re.compile(r"(\+?\d[\d\-\s]{7,}\d)")
+SPACE_RE = re.compile(r"\s+")
+# address keywords in priority order, one precompiled search each: the first keyword
+# present wins, wherever it is (an explicit 地址 beats an earlier 在 as in 现在/我在家).
+# 送到 is tried before 到 so the address keeps the longer keyword.
+ADDRESS_RES = tuple(re.compile(kw) for kw in ("地址", "位置", "送到", "到", "在"))
+LEAVE_TRIGGER = re.compile(r"请假|休假|病假")
+# e.g. 2025-12-31 10:00-18:00
+LEAVE_RE = re.compile(r"(20\d{2}-\d{1,2}-\d{1,2})\s*(\d{1,2}:\d{2})\s*[-~到]\s*(\d{1,2}:\d{2})")
 
 def extract_customer_task_fields(text: str, fallback_phone: str = ""):
     t = (text or "").strip()
     phone = fallback_phone
     m = PHONE_RE.search(t)
     if m:
-        phone = re.sub(r"\s+", "", m.group(1))
+        phone = SPACE_RE.sub("", m.group(1))
 
     address = ""
-    for kw in ["地址", "位置", "到", "在", "送到"]:
-        if kw in t:
-            idx = t.find(kw)
-            address = t[idx: idx+80]
+    for rx in ADDRESS_RES:
+        m = rx.search(t)
+        if m:
+            address = t[m.start(): m.start()+80]
             break
 
     title = (t[:18] + "…") if len(t) > 18 else (t if t else "新任务")
@@ -27,12 +35,12 @@ def detect_leave_request(text: str):
     if not t:
         return None
     # very simple: contains 请假 / 休假 / 病假
-    if ("请假" not in t) and ("休假" not in t) and ("病假" not in t):
+    if not LEAVE_TRIGGER.search(t):
         return None
 
     # parse like: 2025-12-31 10:00-18:00
     start, end = None, None
-    m = re.search(r"(20\d{2}-\d{1,2}-\d{1,2})\s*(\d{1,2}:\d{2})\s*[-~到]\s*(\d{1,2}:\d{2})", t)
+    m = LEAVE_RE.search(t)
     if m:
         d = m.group(1)
         t1, t2 = m.group(2), m.group(3)
@@ -110,8 +110,12 @@ EN = {
   "hint_time": "e.g. 2025-12-30 14:30",
 }
 
-def t(lang: str, key: str) -> str:
+TABLES = {"zh": ZH, "en": EN}
+
+def table(lang: str) -> dict[str, str]:
+  # whole table for a language: hot render paths index it directly (both tables share keys)
   lang = (lang or "zh").lower()
-  if lang.startswith("en"):
-    return EN.get(key, key)
-  return ZH.get(key, key)
+  return TABLES.get(lang[:2], ZH)
+
+def t(lang: str, key: str) -> str:
+  return table(lang).get(key, key)
@@ -0,0 +1,24 @@
+from __future__ import annotations
+import json
+
+# orjson is an optional speedup (bundled by requirements.txt); stdlib json otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps_bytes(obj) -> bytes:
+    # compact UTF-8 JSON (no ASCII escaping)
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def loads(data: str | bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,8 +1,15 @@
 from __future__ import annotations
 import re
 
+KEYWORD_RE = re.compile(r"[\u4e00-\u9fff]{2,}|[A-Za-z0-9]{3,}")
+
+# kb id -> (version, lowercased title+content+tags); upsert_kb bumps version.
+# Cleared whenever db.kb_version() moves, so deleted entries don't linger.
+_HAY_CACHE: dict[int, tuple[int, str]] = {}
+_hay_kb_version = -1
+
 def _keywords(text: str):
-    parts = re.findall(r"[\u4e00-\u9fff]{2,}|[A-Za-z0-9]{3,}", text or "")
+    parts = KEYWORD_RE.findall(text or "")
     seen, out = set(), []
     for p in parts:
         if p in seen:
@@ -13,21 +20,47 @@ def _keywords(text: str):
             break
     return out
 
+def _haystack(r) -> str:
+    kid, ver = r.get("id"), r.get("version", 0)
+    hit = _HAY_CACHE.get(kid) if kid is not None else None
+    if hit and hit[0] == ver:
+        return hit[1]
+    hay = (r.get("title","") + "\n" + r.get("content","") + "\n" + r.get("tags","")).lower()
+    if kid is not None:
+        _HAY_CACHE[kid] = (ver, hay)
+    return hay
+
 def pick_kb_context(user_text: str, kb_rows, max_items: int = 4):
-    kws = _keywords(user_text)
+    kws = [k.lower() for k in _keywords(user_text)]
+    if not kws:
+        return []
     scored = []
     for r in kb_rows:
         if not r.get("enabled"):
             continue
-        hay = (r.get("title","") + "\n" + r.get("content","") + "\n" + r.get("tags","")).lower()
+        hay = _haystack(r)
         score = 0
         for k in kws:
-            if k.lower() in hay:
+            if k in hay:
                 score += 1
         if score > 0:
             scored.append((score, r))
     scored.sort(key=lambda x: (-x[0], str(x[1].get("updated_time",""))))
+    return _context_messages(r for _, r in scored[:max_items])
+
+def kb_context(db, user_text: str, max_items: int = 4):
+    # SQLite FTS5/bm25 does the ranking; Python scoring only as a fallback
+    rows = db.search_kb(_keywords(user_text), limit=max_items)
+    if rows is None:
+        global _hay_kb_version
+        if db.kb_version() != _hay_kb_version:
+            _HAY_CACHE.clear()
+            _hay_kb_version = db.kb_version()
+        return pick_kb_context(user_text, db.list_kb(limit=500, enabled_only=True), max_items=max_items)
+    return _context_messages(rows)
+
+def _context_messages(rows):
     out = []
-    for _, r in scored[:max_items]:
+    for r in rows:
         out.append({"role": "system", "content": f"知识库：{r.get('title','')}\n{r.get('content','')}".strip()})
     return out
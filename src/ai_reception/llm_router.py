@@ -1,6 +1,83 @@
 from __future__ import annotations
-import json, urllib.request
+import re, gzip, time, queue, socket, threading, http.client, urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
 from dataclasses import dataclass
+from urllib.parse import urlsplit
+from . import jsonutil
+
+# cloud_first: head start given to the cloud call before Ollama is started in parallel
+CLOUD_HEAD_START_S = 0.4
+# identical prompts within a session reuse the previous reply
+REPLY_CACHE_SIZE = 256
+# per-request socket timeouts (connect / each read while streaming)
+OLLAMA_TIMEOUT_S = 5
+CLOUD_TIMEOUT_S = 10
+# Ollama, only while waiting for its reply to start (connect and send keep
+# OLLAMA_TIMEOUT_S): a cold model load can take tens of seconds, and timing
+# that out would trip the breaker right after startup
+OLLAMA_LOAD_TIMEOUT_S = 60
+# circuit breaker: after BREAKER_FAILS consecutive failures skip the backend for BREAKER_COOLDOWN_S
+BREAKER_FAILS = 3
+BREAKER_COOLDOWN_S = 30
+
+# inputs not worth an LLM round trip: empty, bare phone numbers, greetings/acks
+TRIVIAL_RE = re.compile(
+    r"^\s*(?:\+?[\d\-\s]{6,}|你好|您好|在吗|在不在|在么|哈喽|嗨|好的|谢谢|收到|ok|hi|hello|hey|thanks?)?"
+    r"[\s!！。.，,~～?？]*$",
+    re.IGNORECASE,
+)
+KB_PREFIX = "知识库："
+
+def _should_skip_llm(text: str) -> bool:
+    return bool(TRIVIAL_RE.match(text or ""))
+
+def _canned_reply(messages) -> str:
+    # best local answer without a model: the top KB snippet the caller attached
+    for m in messages:
+        c = m.get("content") or ""
+        if m.get("role") == "system" and c.startswith(KB_PREFIX):
+            return c.split("\n", 1)[-1].strip()
+    return ""
+
+class _Cancel:
+    """
+    Stop flag shared by the streams of one race. cancel() also shuts down the
+    sockets they are reading, so a read blocked on a slow backend returns at once
+    instead of running into its timeout.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._socks: set[socket.socket] = set()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def attach(self, sock: socket.socket | None):
+        if sock is None:
+            return
+        with self._lock:
+            self._socks.add(sock)
+            if self._event.is_set():
+                self._shutdown(sock)
+
+    def detach(self, sock: socket.socket | None):
+        with self._lock:
+            self._socks.discard(sock)
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            for sock in self._socks:
+                self._shutdown(sock)
+
+    @staticmethod
+    def _shutdown(sock: socket.socket):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
 @dataclass
 class LLMConfig:
@@ -14,17 +91,59 @@ class LLMConfig:
 class LLMRouter:
     def __init__(self, cfg: LLMConfig):
         self.cfg = cfg
+        # keep-alive connections per (scheme, host, port): reuse TCP/TLS across calls
+        # value: (connection, send absolute URL because it goes through a plain HTTP proxy)
+        self._conns: dict[tuple, tuple[http.client.HTTPConnection, bool]] = {}
+        self._pool: ThreadPoolExecutor | None = None
+        self._replies: OrderedDict[tuple, str] = OrderedDict()
+        # cancel tokens of the races still running, so close() can stop their streams
+        self._races: set[_Cancel] = set()
+        # backend -> (consecutive failures, monotonic time before which it is skipped)
+        self._breaker: dict[str, tuple[int, float]] = {"ollama": (0, 0.0), "cloud": (0, 0.0)}
+
+    def _tripped(self, backend: str) -> bool:
+        return time.monotonic() < self._breaker[backend][1]
+
+    def _record(self, backend: str, ok: bool):
+        if ok:
+            self._breaker[backend] = (0, 0.0)
+            return
+        # the count is kept while open, so one more failure after the cooldown re-trips it
+        fails = self._breaker[backend][0] + 1
+        until = time.monotonic() + BREAKER_COOLDOWN_S if fails >= BREAKER_FAILS else 0.0
+        self._breaker[backend] = (fails, until)
+
+    def _fast_path(self, mode: str, messages):
+        # -> (key, reply or None); reply "" means "handled locally, nothing to say"
+        last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        if _should_skip_llm(last):
+            return None, _canned_reply(messages)
+        key = (mode, tuple((m.get("role",""), m.get("content","")) for m in messages))
+        hit = self._replies.get(key)
+        if hit is not None:
+            self._replies.move_to_end(key)
+        return key, hit
+
+    def _remember(self, key, reply: str):
+        self._replies[key] = reply
+        if len(self._replies) > REPLY_CACHE_SIZE:
+            self._replies.popitem(last=False)
 
     def chat(self, messages: list[dict[str,str]]):
         mode = (self.cfg.mode or "local_first").lower()
         if mode == "off":
             return False, ""
+        key, hit = self._fast_path(mode, messages)
+        if hit is not None:
+            return bool(hit), hit
+        ok, out = self._chat(mode, messages)
+        if ok:
+            self._remember(key, out)
+        return ok, out
+
+    def _chat(self, mode: str, messages):
         if mode == "cloud_first":
-            ok, out = self._cloud_chat(messages)
-            if ok: return True, out
-            ok, out = self._ollama_chat(messages)
-            if ok: return True, out
-            return False, ""
+            return self._race_cloud_first(messages)
         else:
             ok, out = self._ollama_chat(messages)
             if ok: return True, out
@@ -32,38 +151,353 @@ class LLMRouter:
             if ok: return True, out
             return False, ""
 
+    def _race_cloud_first(self, messages):
+        """
+        Start cloud and, if it hasn't answered within CLOUD_HEAD_START_S, Ollama
+        in parallel; first successful reply wins (the loser's result is ignored).
+        An outage then costs ~0.4s instead of the full cloud timeout.
+        local_first stays sequential so it never spends cloud tokens needlessly.
+        """
+        pool = self._executor()
+        cloud = pool.submit(self._cloud_chat, messages)
+        try:
+            ok, out = cloud.result(timeout=CLOUD_HEAD_START_S)
+            if ok: return True, out
+        except FutureTimeout:
+            pass
+        local = pool.submit(self._ollama_chat, messages)
+        for f in as_completed([cloud, local]):
+            ok, out = f.result()
+            if ok: return True, out
+        return False, ""
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            # 4 workers: a slow loser from the previous call may still be running
+            self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm")
+        return self._pool
+
+    def chat_stream(self, messages: list[dict[str,str]]):
+        """
+        Like chat(), but yields the reply text so far each time a delta arrives.
+        A backend that fails mid-stream has its partial reply discarded (an ""
+        is yielded so callers reset what they show) and the next one is tried.
+        Only a reply whose stream reached its done marker is cached.
+        cloud_first races the backends like chat() does (see _race_stream).
+        """
+        mode = (self.cfg.mode or "local_first").lower()
+        if mode == "off":
+            return
+        key, hit = self._fast_path(mode, messages)
+        if hit is not None:
+            if hit:
+                yield hit
+            return
+        if mode == "cloud_first":
+            reply = yield from self._race_stream(messages)
+            if reply:
+                self._remember(key, reply.strip())
+            return
+        for backend in (self._ollama_stream, self._cloud_stream):
+            text = ""
+            try:
+                for delta in backend(messages):
+                    text += delta
+                    yield text
+            except Exception:
+                if text:
+                    yield ""
+                continue
+            if text:
+                self._remember(key, text.strip())
+                return
+
+    def _race_stream(self, messages):
+        """
+        cloud_first streaming: cloud gets CLOUD_HEAD_START_S to produce its first
+        delta (or fail), then Ollama is started as well and whichever yields first
+        is streamed. The other keeps buffering as the fallback until the winner
+        ends. Same yields as chat_stream; returns the finished reply or "".
+        """
+        q: queue.Queue = queue.Queue()
+        stop = _Cancel()
+        self._races.add(stop)
+        streams = {"cloud": self._cloud_stream, "ollama": self._ollama_stream}
+        text: dict[str, str] = {}     # started backend -> its reply so far
+        ended: dict[str, bool] = {}   # backend -> True finished cleanly / False failed
+        winner = None
+
+        def start(name: str):
+            text[name] = ""
+            self._executor().submit(self._pump, name, streams[name](messages, stop), q, stop)
+
+        start("cloud")
+        deadline = time.monotonic() + CLOUD_HEAD_START_S
+        try:
+            while True:
+                wait = None
+                if "ollama" not in text:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0 or "cloud" in ended:
+                        start("ollama")
+                        wait = None
+                if len(ended) == len(streams):
+                    return ""
+                try:
+                    name, item = q.get(timeout=wait)
+                except queue.Empty:
+                    continue  # head start is over: the next pass starts Ollama
+                if isinstance(item, str):
+                    text[name] += item
+                    winner = winner or name
+                    if name == winner:
+                        yield text[name]
+                    continue
+                ended[name] = item
+                if not item:
+                    text[name] = ""  # failed: nothing of it is usable
+                if name != winner:
+                    continue
+                if item:
+                    return text[name]
+                # the streamed backend failed: switch to the other one's buffer
+                yield ""
+                winner = None
+                other = "ollama" if name == "cloud" else "cloud"
+                if text.get(other):
+                    winner = other
+                    yield text[other]
+                    if ended.get(other):
+                        return text[other]
+        finally:
+            # the loser stops now, even mid-read; the winner has already finished
+            stop.cancel()
+            self._races.discard(stop)
+
+    @staticmethod
+    def _pump(name: str, stream, q: queue.Queue, stop: _Cancel):
+        # worker side of _race_stream: forwards deltas, then True (clean end) or False (failed)
+        try:
+            for delta in stream:
+                if stop.is_set():
+                    stream.close()
+                    return
+                q.put((name, delta))
+        except Exception:
+            q.put((name, False))
+            return
+        q.put((name, True))
+
+    def close(self):
+        # stop running races first: their workers are joined at interpreter exit
+        for race in list(self._races):
+            race.cancel()
+        for conn, _ in self._conns.values():
+            conn.close()
+        self._conns.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _connect(self, u, timeout: float):
+        # honour system/env proxies like urllib.request.urlopen did
+        proxy = urllib.request.getproxies().get(u.scheme)
+        if proxy and not urllib.request.proxy_bypass(u.hostname or ""):
+            p = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            if u.scheme == "https":
+                conn = http.client.HTTPSConnection(p.hostname, p.port, timeout=timeout)
+                conn.set_tunnel(u.hostname, u.port)
+            else:
+                conn = http.client.HTTPConnection(p.hostname, p.port, timeout=timeout)
+            return conn, u.scheme == "http"
+        cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+        return cls(u.hostname, u.port, timeout=timeout), False
+
+    def _request(self, url: str, payload, headers: dict[str,str], timeout: float,
+                 stop: _Cancel | None = None, first_timeout: float | None = None):
+        # -> (key, conn, absolute, resp); caller reads resp then calls _release().
+        # timeout covers connect + send; first_timeout (if given) the wait for the
+        # status line after it, and the caller restores timeout for its body reads.
+        # With stop, the socket is attached before sending, so a cancel also ends
+        # the wait for the status line; the caller detaches it once done.
+        u = urlsplit(url)
+        key = (u.scheme, u.hostname, u.port)
+        body = jsonutil.dumps_bytes(payload)
+        headers = {"Content-Type": "application/json", **headers}
+        conn, absolute = self._conns.pop(key, (None, False))
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn, absolute = self._connect(u, timeout)
+            elif conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            path = url if absolute else ((u.path or "/") + (f"?{u.query}" if u.query else ""))
+            try:
+                if stop is not None:
+                    if conn.sock is None:
+                        conn.connect()
+                    stop.attach(conn.sock)
+                conn.request("POST", path, body=body, headers=headers)
+                if first_timeout is not None:
+                    conn.sock.settimeout(first_timeout)
+                resp = conn.getresponse()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                if stop is not None:
+                    stop.detach(conn.sock)
+                conn.close()
+                if not reused:
+                    raise
+                conn = None  # idle keep-alive socket was dropped by the server: reconnect once
+            except Exception:
+                if stop is not None:
+                    stop.detach(conn.sock)
+                conn.close()
+                raise
+        if resp.status >= 400:
+            resp.read()
+            if stop is not None:
+                stop.detach(conn.sock)
+            self._release(key, conn, absolute, resp)
+            raise http.client.HTTPException(f"HTTP {resp.status}")
+        return key, conn, absolute, resp
+
+    def _release(self, key, conn, absolute: bool, resp):
+        resp.close()  # fully read: mark it done so the connection accepts the next request
+        # setdefault is atomic: if a parallel call already pooled one, drop ours
+        if resp.will_close or self._conns.setdefault(key, (conn, absolute))[0] is not conn:
+            conn.close()
+
+    def _post_json(self, url: str, payload, headers: dict[str,str], timeout: float,
+                   first_timeout: float | None = None):
+        key, conn, absolute, resp = self._request(url, payload, {"Accept-Encoding": "gzip", **headers},
+                                                  timeout, first_timeout=first_timeout)
+        try:
+            if first_timeout is not None and conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            raw = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        self._release(key, conn, absolute, resp)
+        if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+            raw = gzip.decompress(raw)
+        return jsonutil.loads(raw)
+
+    def _post_lines(self, url: str, payload, headers: dict[str,str], timeout: float,
+                    first_timeout: float | None = None, stop: _Cancel | None = None):
+        # yields decoded non-empty lines of a streamed (NDJSON / SSE) response;
+        # first_timeout (if given) covers the wait for the status line and first line,
+        # timeout the connect/send and every read after it;
+        # stop (if given) is checked between reads and can interrupt a blocked one
+        key, conn, absolute, resp = self._request(url, payload, headers, timeout, stop, first_timeout)
+        finished = False
+        first = first_timeout is not None
+        try:
+            while True:
+                if stop is not None and stop.is_set():
+                    break
+                line = resp.readline()
+                if first:
+                    first = False
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                if not line:
+                    # a cancel's socket shutdown also reads as EOF: don't pool that socket
+                    finished = stop is None or not stop.is_set()
+                    break
+                line = line.decode("utf-8").strip()
+                if line:
+                    yield line
+        finally:
+            if stop is not None:
+                stop.detach(conn.sock)
+            if finished:
+                self._release(key, conn, absolute, resp)
+            else:
+                conn.close()  # abandoned mid-stream: the socket still has unread data
+
     def _ollama_chat(self, messages):
         base = (self.cfg.ollama_base_url or "").rstrip("/")
-        if not base:
+        if not base or self._tripped("ollama"):
             return False, ""
         url = f"{base}/api/chat"
         payload = {"model": self.cfg.ollama_model or "llama3.1:8b", "messages": messages, "stream": False}
         try:
-            req = urllib.request.Request(url, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-                                         headers={"Content-Type":"application/json"}, method="POST")
-            with urllib.request.urlopen(req, timeout=8) as resp:
-                data = json.loads(resp.read().decode("utf-8"))
+            # not streamed: the status line only comes once the whole reply (and any model load) is done
+            data = self._post_json(url, payload, {}, timeout=OLLAMA_TIMEOUT_S, first_timeout=OLLAMA_LOAD_TIMEOUT_S)
             content = ((data.get("message") or {}).get("content") or "").strip()
-            return (True, content) if content else (False, "")
         except Exception:
+            self._record("ollama", False)
             return False, ""
+        self._record("ollama", True)
+        return (True, content) if content else (False, "")
 
     def _cloud_chat(self, messages):
         key = (self.cfg.cloud_api_key or "").strip()
         base = (self.cfg.cloud_base_url or "").rstrip("/")
-        if not key or not base:
+        if not key or not base or self._tripped("cloud"):
             return False, ""
         url = f"{base}/v1/chat/completions"
         payload = {"model": self.cfg.cloud_model or "gpt-4o-mini", "messages": messages, "temperature": 0.4}
         try:
-            req = urllib.request.Request(url, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-                                         headers={"Content-Type":"application/json","Authorization":f"Bearer {key}"},
-                                         method="POST")
-            with urllib.request.urlopen(req, timeout=12) as resp:
-                data = json.loads(resp.read().decode("utf-8"))
+            data = self._post_json(url, payload, {"Authorization": f"Bearer {key}"}, timeout=CLOUD_TIMEOUT_S)
             ch = (data.get("choices") or [])
-            if not ch: return False, ""
-            msg = ((ch[0].get("message") or {}).get("content") or "").strip()
-            return (True, msg) if msg else (False, "")
+            msg = ((ch[0].get("message") or {}).get("content") or "").strip() if ch else ""
         except Exception:
+            self._record("cloud", False)
             return False, ""
+        self._record("cloud", True)
+        return (True, msg) if msg else (False, "")
+
+    def _ollama_stream(self, messages, stop: _Cancel | None = None):
+        base = (self.cfg.ollama_base_url or "").rstrip("/")
+        if not base or self._tripped("ollama"):
+            return
+        url = f"{base}/api/chat"
+        payload = {"model": self.cfg.ollama_model or "llama3.1:8b", "messages": messages, "stream": True}
+        done = False
+        try:
+            for line in self._post_lines(url, payload, {}, timeout=OLLAMA_TIMEOUT_S,
+                                         first_timeout=OLLAMA_LOAD_TIMEOUT_S, stop=stop):
+                data = jsonutil.loads(line)
+                delta = (data.get("message") or {}).get("content") or ""
+                if delta:
+                    yield delta
+                done = done or bool(data.get("done"))
+            if not done:
+                raise ConnectionError("stream ended before done:true")
+        except Exception:
+            if stop is None or not stop.is_set():  # being cancelled isn't the backend's fault
+                self._record("ollama", False)
+            raise
+        self._record("ollama", True)
+
+    def _cloud_stream(self, messages, stop: _Cancel | None = None):
+        key = (self.cfg.cloud_api_key or "").strip()
+        base = (self.cfg.cloud_base_url or "").rstrip("/")
+        if not key or not base or self._tripped("cloud"):
+            return
+        url = f"{base}/v1/chat/completions"
+        payload = {"model": self.cfg.cloud_model or "gpt-4o-mini", "messages": messages, "temperature": 0.4, "stream": True}
+        done = False
+        try:
+            for line in self._post_lines(url, payload, {"Authorization": f"Bearer {key}"},
+                                         timeout=CLOUD_TIMEOUT_S, stop=stop):
+                if not line.startswith("data:"):
+                    continue
+                chunk = line[5:].strip()
+                if chunk == "[DONE]":
+                    done = True
+                    continue  # read to EOF so the connection can be reused
+                ch = jsonutil.loads(chunk).get("choices") or []
+                delta = ((ch[0].get("delta") or {}).get("content") or "") if ch else ""
+                if delta:
+                    yield delta
+            if not done:
+                raise ConnectionError("stream ended before [DONE]")
+        except Exception:
+            if stop is None or not stop.is_set():  # being cancelled isn't the backend's fault
+                self._record("cloud", False)
+            raise
+        self._record("cloud", True)
@@ -1,21 +1,132 @@
 from __future__ import annotations
-import json
+import logging, queue, threading
 import tkinter as tk
 from tkinter import ttk, messagebox
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Callable
 
-from .db import DB
-from .i18n import t as tr
+from .db import DB, KB_PAGE_SIZE
+from .i18n import t as tr, table as tr_table
 from .sms_gateway import SmsGateway
 from .extract import extract_customer_task_fields, detect_leave_request
 from .llm_router import LLMRouter, LLMConfig
-from .kb_search import pick_kb_context
+from .kb_search import kb_context
 from .timeutil import parse_friendly_dt, dt_to_iso
 
+log = logging.getLogger(__name__)
+
+# search boxes wait this long after the last keystroke before querying
+SEARCH_DEBOUNCE_MS = 200
+KB_SEARCH_DEBOUNCE_MS = 150
+# KB entries longer than this are loaded into the editor in chunks from after_idle
+KB_STREAM_MIN = 32_768
+KB_STREAM_CHUNK = 8_192
+# chat Text keeps at most this many lines; older ones are trimmed from the top
+CHAT_MAX_LINES = 200
+# how often the Tk thread checks whether a background DB query has finished
+DB_POLL_MS = 15
+
+_db_pool: ThreadPoolExecutor | None = None
+
+def _db_executor() -> ThreadPoolExecutor:
+    # shared by all views; DB reads are safe off the Tk thread (per-thread reader connections)
+    global _db_pool
+    if _db_pool is None:
+        _db_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="db")
+    return _db_pool
+
+# Tcl-side row loops: fill a Treeview from a list of value tuples in one round trip
+_TREE_FILL_PROC = "proc ::aireception_tree_fill {w rows} {foreach r $rows {$w insert {} end -values $r}}"
+# same, but at a given position with explicit iids: flat list of iid, values, iid, values ...
+_TREE_INSERT_PROC = (
+    "proc ::aireception_tree_insert {w index items} {"
+    "foreach {iid vals} $items {$w insert {} $index -id $iid -values $vals; "
+    "if {$index ne {end}} {incr index}}}"
+)
+
+def _tcl_proc(w: tk.Misc, name: str, script: str):
+    if not w.tk.call("info", "commands", name):
+        w.tk.eval(script)
+
+def _entry_set(entry: ttk.Entry, value: str):
+    # no-op when unchanged, so re-showing a form doesn't rewrite every field
+    if entry.get() == value:
+        return
+    if isinstance(entry, ttk.Combobox):
+        entry.set(value)    # readonly comboboxes refuse delete/insert
+        return
+    entry.delete(0, tk.END)
+    entry.insert(0, value)
+
+def _tree_fill(tree: ttk.Treeview, rows: list[tuple]):
+    _tcl_proc(tree, "::aireception_tree_fill", _TREE_FILL_PROC)
+    tree.tk.call("::aireception_tree_fill", tree._w, tuple(rows))
+
+def _tree_insert(tree: ttk.Treeview, index: int|str, items: list[tuple[Any, tuple]]):
+    # items: (iid, values) pairs, inserted in order starting at index
+    _tcl_proc(tree, "::aireception_tree_insert", _TREE_INSERT_PROC)
+    tree.tk.call("::aireception_tree_insert", tree._w, index, tuple(x for item in items for x in item))
+
 def _safe_int(s: str, default: int) -> int:
     try: return int(str(s).strip())
     except Exception: return default
 
+class _View(ttk.Frame):
+    """
+    Base for the main views: language lookup + in-place retranslation.
+    Widgets built through _tr() are re-labelled by retranslate() instead of being rebuilt.
+    """
+    def __init__(self, master: tk.Misc, db: DB, get_lang):
+        super().__init__(master)
+        self.db = db
+        self.get_lang = get_lang
+        # (apply(text), i18n key) per translated widget option
+        self._i18n: list[tuple[Callable[[str], Any], str]] = []
+        # current language's string table, for per-row lookups while rendering
+        self.T = tr_table(get_lang())
+        # latest ticket per background job name; older results are dropped
+        self._tickets: dict[str,int] = {}
+
+    def lang(self): return self.get_lang()
+
+    def _tr_apply(self, apply: Callable[[str], Any], key: str):
+        apply(self.T.get(key, key))
+        self._i18n.append((apply, key))
+
+    def _tr(self, widget, key: str, option: str = "text"):
+        self._tr_apply(lambda text: widget.configure(**{option: text}), key)
+        return widget
+
+    def _bg(self, name: str, fn: Callable[..., Any], *args, apply: Callable[[Any], Any],
+            on_error: Callable[[BaseException], Any] | None = None):
+        """
+        Run fn(*args) on the DB worker and hand the result to apply() on the Tk thread.
+        Only the newest job per name is applied, so bursts of refreshes can't render stale data.
+        If fn raises, the error is logged and passed to on_error() instead.
+        """
+        ticket = self._tickets[name] = self._tickets.get(name, 0) + 1
+        fut = _db_executor().submit(fn, *args)
+
+        def poll():
+            if not fut.done():
+                self.after(DB_POLL_MS, poll)
+            elif self._tickets.get(name) != ticket:
+                return
+            elif fut.exception() is not None:
+                log.error("background job %r failed", name, exc_info=fut.exception())
+                if on_error is not None:
+                    on_error(fut.exception())
+            else:
+                apply(fut.result())
+        self.after(DB_POLL_MS, poll)
+
+    def retranslate(self):
+        # the language table is resolved once per switch; each label is then a dict lookup
+        T = self.T = tr_table(self.lang())
+        for apply, key in self._i18n:
+            apply(T.get(key, key))
+
 class RootUI(ttk.Frame):
     """
     WeChat desktop-ish layout:
@@ -61,49 +172,64 @@ class RootUI(ttk.Frame):
             self.after(2500, self._tick)
 
     def _build_views(self):
-        for c in list(self.main.winfo_children()):
-            c.destroy()
-        self.views = {
-            "chat": ChatView(self.main, self.db, get_lang=lambda: self.lang),
-            "schedule": ScheduleView(self.main, self.db, get_lang=lambda: self.lang),
-            "staff": StaffView(self.main, self.db, get_lang=lambda: self.lang),
-            "me": MeView(self.main, self.db, get_lang=lambda: self.lang, on_lang_changed=self.rebuild),
+        # views are built on first show(): startup only pays for the chat view
+        get_lang = lambda: self.lang
+        self._view_factories = {
+            "chat": lambda: ChatView(self.main, self.db, get_lang=get_lang),
+            "schedule": lambda: ScheduleView(self.main, self.db, get_lang=get_lang),
+            "staff": lambda: StaffView(self.main, self.db, get_lang=get_lang),
+            "me": lambda: MeView(self.main, self.db, get_lang=get_lang, on_lang_changed=self.retranslate),
         }
-        for v in self.views.values():
-            v.place(relx=0, rely=0, relwidth=1, relheight=1)
 
     def _build_sidebar(self):
-        for c in list(self.sidebar.winfo_children()):
-            c.destroy()
-
         # simple emoji buttons (no assets)
         btns = [
-            ("💬", "chat", tr(self.lang, "tab_reception")),
-            ("📅", "schedule", tr(self.lang, "tab_schedule")),
-            ("🧑‍💼", "staff", tr(self.lang, "tab_staff")),
-            ("⚙️", "me", tr(self.lang, "tab_me")),
+            ("💬", "chat", "tab_reception"),
+            ("📅", "schedule", "tab_schedule"),
+            ("🧑‍💼", "staff", "tab_staff"),
+            ("⚙️", "me", "tab_me"),
         ]
+        # one widget per entry: icon with its caption underneath
+        self.style.configure("Sidebar.TButton", justify="center")
+        self.sidebar_btns: list[tuple[ttk.Button, str, str]] = []
         ttk.Label(self.sidebar, text="").pack(pady=6)
-        for icon, key, tip in btns:
-            b = ttk.Button(self.sidebar, text=icon, width=3, command=lambda k=key: self.show(k))
-            b.pack(pady=6, padx=6)
-            # tooltip-lite: show label below
-            ttk.Label(self.sidebar, text=tip, wraplength=48, justify="center").pack(pady=(0,8))
+        for icon, key, tip_key in btns:
+            b = ttk.Button(self.sidebar, text=f"{icon}\n{tr(self.lang, tip_key)}", width=-6,
+                           style="Sidebar.TButton", command=lambda k=key: self.show(k))
+            # negative width = minimum (ttk): longer English captions widen the column
+            b.pack(pady=6, padx=6, fill="x")
+            self.sidebar_btns.append((b, icon, tip_key))
 
     def show(self, key: str):
         v = self.views.get(key)
-        if v:
+        if v is None and key in self._view_factories:
+            # a freshly built view has just loaded its data: no on_show() refresh needed
+            v = self.views[key] = self._view_factories[key]()
+            v.place(relx=0, rely=0, relwidth=1, relheight=1)
+            v.lift()
+        elif v:
             v.lift()
             if hasattr(v, "on_show"):
                 v.on_show()
 
-    def rebuild(self):
-        self.lang = self.db.get_setting("lang") or "zh"
-        self._build_views()
-        self._build_sidebar()
-        self.show("chat")
+    def retranslate(self):
+        # language switch relabels the existing widgets; nothing is destroyed/rebuilt
+        lang = self.db.get_setting("lang") or "zh"
+        if lang == self.lang:
+            return
+        self.lang = lang
+        for b, icon, key in self.sidebar_btns:
+            b.configure(text=f"{icon}\n{tr(lang, key)}")
+        for v in self.views.values():
+            v.retranslate()
 
-class ChatView(ttk.Frame):
+    def close(self):
+        # app shutdown: let views stop background work (e.g. LLM streams) first
+        for v in self.views.values():
+            if hasattr(v, "close"):
+                v.close()
+
+class ChatView(_View):
     """
     Three columns:
       - convo list
@@ -111,36 +237,50 @@ class ChatView(ttk.Frame):
       - right task panel
     """
     def __init__(self, master: tk.Misc, db: DB, get_lang):
-        super().__init__(master)
-        self.db = db
-        self.get_lang = get_lang
+        super().__init__(master, db, get_lang)
         self.current_conv_id: int | None = None
         self.current_phone: str = ""
         self.current_task_id: int | None = None
+        self._staff_name_cache: dict[int,str] = {}
+        self._staff_version = -1
+        # rebuilt only when the relevant settings change
+        self._llm: LLMRouter | None = None
+        self._gateway: tuple[str, SmsGateway] | None = None
+        self._reply_pending = False  # an AI reply is streaming on its worker thread
+        self._search_after: str | None = None
+        self.conv_rows: list[dict] = []
+        self._phone_to_idx: dict[str,int] = {}
+        self._conv_lines: list[str] = []
+        self._task_token: tuple | None = None
+        # what the chat Text currently shows: conversation + newest message id
+        self._loaded_conv_id: int | None = None
+        self._last_msg_id = 0
+        # refreshes requested during the current event, run once from after_idle
+        self._pending: set[str] = set()
+        self._flush_scheduled = False
 
         self._build()
         self.refresh()
 
-    def lang(self): return self.get_lang()
-
     def _build(self):
         top = ttk.Frame(self)
         top.pack(fill="x", padx=8, pady=6)
 
-        ttk.Label(top, text=tr(self.lang(),"search")).pack(side="left")
-        self.q = tk.StringVar()
-        e = ttk.Entry(top, textvariable=self.q, width=26)
+        self._tr(ttk.Label(top), "search").pack(side="left")
+        # hot-path inputs are read straight from the Entry (no StringVar round trip)
+        e = self._search_entry = ttk.Entry(top, width=26)
         e.pack(side="left", padx=6)
-        e.bind("<KeyRelease>", lambda ev: self.refresh_convs())
+        e.bind("<KeyRelease>", lambda ev: self._on_search_key())
 
         # kind filter like tabs
         self.kind = tk.StringVar(value="all")
-        for k, label in [("all", tr(self.lang(),"all")), ("customer", tr(self.lang(),"customers")), ("staff", tr(self.lang(),"employees"))]:
-            ttk.Radiobutton(top, text=label, value=k, variable=self.kind, command=self.refresh_convs).pack(side="left", padx=6)
+        for k, key in [("all", "all"), ("customer", "customers"), ("staff", "employees")]:
+            self._tr(ttk.Radiobutton(top, value=k, variable=self.kind, command=self.refresh_convs), key).pack(side="left", padx=6)
 
-        ttk.Button(top, text=tr(self.lang(),"simulate_in"), command=self.sim_inbound).pack(side="right", padx=6)
-        ttk.Button(top, text=tr(self.lang(),"make_task"), command=self.make_task_from_chat).pack(side="right", padx=6)
-        ttk.Button(top, text=tr(self.lang(),"ai_reply_once"), command=self.ai_reply_once).pack(side="right", padx=6)
+        self._tr(ttk.Button(top, command=self.sim_inbound), "simulate_in").pack(side="right", padx=6)
+        self._tr(ttk.Button(top, command=self.make_task_from_chat), "make_task").pack(side="right", padx=6)
+        self.ai_btn = self._tr(ttk.Button(top, command=self.ai_reply_once), "ai_reply_once")
+        self.ai_btn.pack(side="right", padx=6)
 
         self.status = ttk.Label(self, text="")
         self.status.pack(anchor="w", padx=10)
@@ -170,55 +310,75 @@ class ChatView(ttk.Frame):
         inp = ttk.Entry(bottom, textvariable=self.input)
         inp.pack(side="left", fill="x", expand=True, padx=8)
         inp.bind("<Return>", lambda e: self.send())
-        ttk.Button(bottom, text=tr(self.lang(),"send"), command=self.send).pack(side="right", padx=6)
+        self.send_btn = self._tr(ttk.Button(bottom, command=self.send), "send")
+        self.send_btn.pack(side="right", padx=6)
 
         # right: task panel (like WeChat contact info panel)
         right = ttk.Frame(paned)
         paned.add(right, weight=2)
 
-        ttk.Label(right, text=tr(self.lang(),"dispatch_panel")).pack(anchor="w")
+        self._tr(ttk.Label(right), "dispatch_panel").pack(anchor="w")
 
-        self.contact_info = tk.Text(right, height=5, wrap="word", state="disabled")
+        # read-only panels: Labels only need configure(text=...) per refresh
+        self.contact_info = ttk.Label(right, justify="left", anchor="nw", wraplength=280)
         self.contact_info.pack(fill="x", pady=(6,4))
 
-        self.task_info = tk.Text(right, height=9, wrap="word", state="disabled")
+        self.task_info = ttk.Label(right, justify="left", anchor="nw", wraplength=280)
         self.task_info.pack(fill="x", pady=4)
+        for w in (self.contact_info, self.task_info):
+            w.bind("<Configure>", lambda e: e.widget.configure(wraplength=max(e.width - 8, 80)))
 
         form = ttk.Frame(right)
         form.pack(fill="x", pady=4)
-        ttk.Label(form, text=tr(self.lang(),"staff")).grid(row=0, column=0, sticky="w")
+        self._tr(ttk.Label(form), "staff").grid(row=0, column=0, sticky="w")
         self.staff_var = tk.StringVar()
         self.staff_cb = ttk.Combobox(form, textvariable=self.staff_var, state="readonly")
         self.staff_cb.grid(row=0, column=1, sticky="we", padx=6)
         form.columnconfigure(1, weight=1)
 
-        ttk.Label(form, text=tr(self.lang(),"start_time")).grid(row=1, column=0, sticky="w", pady=6)
+        self._tr(ttk.Label(form), "start_time").grid(row=1, column=0, sticky="w", pady=6)
         self.start_var = tk.StringVar()
         ttk.Entry(form, textvariable=self.start_var).grid(row=1, column=1, sticky="we", padx=6)
-        ttk.Label(form, text=tr(self.lang(),"hint_time")).grid(row=2, column=1, sticky="w", padx=6)
+        self._tr(ttk.Label(form), "hint_time").grid(row=2, column=1, sticky="w", padx=6)
 
         dur = ttk.Frame(right)
         dur.pack(fill="x", pady=4)
         ttk.Label(dur, text="Duration(min)").pack(side="left")
-        self.dur_var = tk.StringVar(value="60")
-        ttk.Entry(dur, textvariable=self.dur_var, width=6).pack(side="left", padx=6)
+        self.dur_entry = ttk.Entry(dur, width=6)
+        self.dur_entry.insert(0, "60")
+        self.dur_entry.pack(side="left", padx=6)
 
         btns = ttk.Frame(right)
         btns.pack(fill="x", pady=6)
-        ttk.Button(btns, text=tr(self.lang(),"hold"), command=self.hold).pack(side="left", expand=True, fill="x", padx=2)
-        ttk.Button(btns, text=tr(self.lang(),"confirm"), command=self.confirm).pack(side="left", expand=True, fill="x", padx=2)
-        ttk.Button(btns, text=tr(self.lang(),"done"), command=self.done).pack(side="left", expand=True, fill="x", padx=2)
-
         btns2 = ttk.Frame(right)
         btns2.pack(fill="x")
-        ttk.Button(btns2, text=tr(self.lang(),"cancel"), command=self.cancel).pack(side="left", expand=True, fill="x", padx=2)
-        ttk.Button(btns2, text=tr(self.lang(),"refresh"), command=self.refresh_task_panel).pack(side="left", expand=True, fill="x", padx=2)
+        # act on current_task_id: disabled while the selected conversation's task is loading
+        self._task_btns = [
+            self._tr(ttk.Button(parent, command=cmd), key)
+            for parent, cmd, key in [(btns, self.hold, "hold"), (btns, self.confirm, "confirm"),
+                                     (btns, self.done, "done"), (btns2, self.cancel, "cancel")]
+        ]
+        for b in self._task_btns:
+            b.pack(side="left", expand=True, fill="x", padx=2)
+        self._tr(ttk.Button(btns2, command=self.refresh_task_panel), "refresh").pack(side="left", expand=True, fill="x", padx=2)
 
     def on_show(self):
         self.refresh()
 
-    def on_tick(self):
+    def retranslate(self):
+        super().retranslate()
+        # message suffixes and the task panel are rendered from translated strings
         if self.current_conv_id:
+            self.load_msgs(self.current_conv_id, full=True)
+            self.refresh_task_panel()
+
+    def _task_state(self):
+        # everything the task panel renders from: task rows + staff names
+        return (self.current_conv_id, self.db.tasks_version(), self.db.staff_version())
+
+    def on_tick(self):
+        # poll the DB change tokens; re-render only when something shown has changed
+        if self.current_conv_id and self._task_token != self._task_state():
             self.refresh_task_panel()
 
     def set_status(self, s: str):
@@ -226,40 +386,96 @@ class ChatView(ttk.Frame):
 
     def refresh(self):
         self.refresh_staff()
-        self.refresh_convs()
+        self._schedule("convs", "msgs", "task")
+
+    def _schedule(self, *names: str):
+        # coalesce: e.g. arrow-keying through conversations renders only the last one
+        self._pending.update(names)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.after_idle(self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, set()
+        self._flush_scheduled = False
+        if "convs" in pending:
+            self.refresh_convs()
         if self.current_conv_id:
-            self.load_msgs(self.current_conv_id)
-            self.refresh_task_panel()
+            if "msgs" in pending:
+                self.load_msgs(self.current_conv_id)
+            if "contact" in pending:
+                self.refresh_contact_panel()
+            if "task" in pending:
+                self.refresh_task_panel()
 
     def refresh_staff(self):
-        staff = self.db.list_staff(include_inactive=False)
+        self._staff_version = self.db.staff_version()
+        everyone = self.db.list_staff(include_inactive=True)
+        # task panel shows names of inactive staff too
+        self._staff_name_cache = {int(s["id"]): s["name"] for s in everyone}
+        staff = [s for s in everyone if s.get("active")]
         self.staff_rows = staff
         vals = [f"{s['id']}: {s['name']} ({s['phone']})" for s in staff]
         self.staff_cb["values"] = vals
         if vals and not self.staff_var.get():
             self.staff_var.set(vals[0])
 
-    def refresh_convs(self):
+    def _on_search_key(self):
+        # debounce: one query after typing pauses, not one per keystroke
+        if self._search_after:
+            self.after_cancel(self._search_after)
+        self._search_after = self.after(SEARCH_DEBOUNCE_MS, self._do_search)
+
+    def _do_search(self):
+        self._search_after = None
+        self.refresh_convs()
+
+    def refresh_convs(self, on_done: Callable[[], Any] | None = None):
+        # query + formatting run on the DB worker; on_done runs once the list is updated
         k = self.kind.get().strip()
-        rows = self.db.list_conversations(self.q.get(), kind_filter=k)
+        self._bg("convs", self._fetch_convs, self._search_entry.get(), k,
+                 apply=lambda res: self._apply_convs(*res, on_done=on_done))
+
+    def _fetch_convs(self, q: str, k: str):
+        rows = self.db.list_conversations(q, kind_filter=k)
+        cust, staff = "👤", "🧑‍💼"
+        lines = [
+            f"{cust if r['kind'] == 'customer' else staff} {r['phone']} | {(r['last_message'] or '')[:24]}"
+            for r in rows
+        ]
+        phone_to_idx = {r["phone"]: i for i, r in enumerate(rows)}
+        return rows, lines, phone_to_idx
+
+    def _apply_convs(self, rows, lines, phone_to_idx, on_done=None):
         self.conv_rows = rows
-        self.conv_list.delete(0, tk.END)
-        for r in rows:
-            phone = r.get("phone","")
-            tag = "👤" if r.get("kind") == "customer" else "🧑‍💼"
-            last = (r.get("last_message") or "")[:24]
-            self.conv_list.insert(tk.END, f"{tag} {phone} | {last}")
+        self._phone_to_idx = phone_to_idx
+        old = self._conv_lines
+        if lines != old:
+            # patch only the tail that differs (one Tcl call per changed row, not per row)
+            i = 0
+            n = min(len(lines), len(old))
+            while i < n and lines[i] == old[i]:
+                i += 1
+            self.conv_list.delete(i, tk.END)
+            if i < len(lines):
+                # Listbox.insert takes many items: one Tcl command for the whole tail
+                self.conv_list.insert(tk.END, *lines[i:])
+            self._conv_lines = lines
+        if on_done:
+            on_done()
 
     def on_select_conv(self):
         sel = self.conv_list.curselection()
         if not sel:
             return
         r = self.conv_rows[int(sel[0])]
+        if int(r["id"]) != self.current_conv_id:
+            # the previous conversation's task must not be acted on until this one's loads
+            self.current_task_id = None
+            self._set_task_btns(False)
         self.current_conv_id = int(r["id"])
         self.current_phone = r["phone"]
-        self.load_msgs(self.current_conv_id)
-        self.refresh_contact_panel()
-        self.refresh_task_panel()
+        self._schedule("msgs", "contact", "task")
 
     def refresh_contact_panel(self):
         if not self.current_conv_id:
@@ -267,36 +483,57 @@ class ChatView(ttk.Frame):
         conv = self.db.get_conversation(self.current_conv_id)
         if not conv:
             return
-        self.contact_info.config(state="normal")
-        self.contact_info.delete("1.0", tk.END)
         kind = conv.get("kind")
         tag = "客户" if kind == "customer" else "员工"
-        self.contact_info.insert(tk.END, f"{tag}\n电话：{conv.get('phone','')}")
-        self.contact_info.config(state="disabled")
+        self.contact_info.configure(text=f"{tag}\n电话：{conv.get('phone','')}")
+
+    def load_msgs(self, conv_id: int, full: bool = False):
+        # same conversation: append only messages newer than the last one shown
+        append = not full and conv_id == self._loaded_conv_id
+        after_id = self._last_msg_id if append else 0
+        self._bg("msgs", self.db.get_messages, conv_id, 400, after_id,
+                 apply=lambda msgs: self._render_msgs(conv_id, msgs, append))
 
-    def load_msgs(self, conv_id: int):
-        msgs = self.db.get_messages(conv_id, limit=400)
+    def _render_msgs(self, conv_id: int, msgs, append: bool):
+        if append and not msgs:
+            return
         self.chat.config(state="normal")
-        self.chat.delete("1.0", tk.END)
-        lang = self.lang()
+        if not append:
+            self.chat.delete("1.0", tk.END)
+            self._loaded_conv_id = conv_id
+            self._last_msg_id = 0
+        if msgs:
+            self._last_msg_id = int(msgs[-1]["id"])
+        # loop invariants resolved once, not per message
+        sent, failed = "  " + self.T["msg_sent_sim"], "  " + self.T["msg_failed_sim"]
+        prefixes = {"in": "对方", "out": "我方"}.get
+        out = []
+        add = out.append
         for m in msgs:
             d = m["direction"]
-            prefix = "对方" if d == "in" else ("我方" if d == "out" else "系统")
-            meta = {}
-            try: meta = json.loads(m.get("meta_json") or "{}")
-            except Exception: meta = {}
+            meta = m["meta"]
             suffix = ""
             if d == "out" and meta.get("channel") == "sms":
-                st = meta.get("status") or "sent"
-                suffix = "  " + (tr(lang, "msg_sent_sim") if st == "sent" else tr(lang, "msg_failed_sim"))
-            self.chat.insert(tk.END, f"{prefix}：{m['text']}{suffix}\n")
+                suffix = sent if (meta.get("status") or "sent") == "sent" else failed
+            add(f"{prefixes(d, '系统')}：{m['text']}{suffix}\n")
+        # one Tcl insert for the whole batch instead of one per message
+        self.chat.insert(tk.END, "".join(out))
+        # bounded window: layout cost must not grow with the session
+        lines = int(self.chat.index("end-1c").split(".")[0])
+        if lines > CHAT_MAX_LINES:
+            self.chat.delete("1.0", f"{lines - CHAT_MAX_LINES}.0")
         self.chat.config(state="disabled")
         self.chat.see(tk.END)
 
     def _sms_gateway(self) -> SmsGateway:
-        return SmsGateway(self.db.get_setting("sms_mode"))
+        mode = self.db.get_setting("sms_mode")
+        if self._gateway is None or self._gateway[0] != mode:
+            self._gateway = (mode, SmsGateway(mode))
+        return self._gateway[1]
 
     def send(self):
+        if self._reply_pending:
+            return  # <Return> in the input bypasses the disabled button
         if not self.current_phone:
             messagebox.showinfo("提示", "先选一个会话（或模拟收到短信创建会话）")
             return
@@ -306,12 +543,11 @@ class ChatView(ttk.Frame):
         ok, status, msg_id = self._sms_gateway().send_sms(self.current_phone, text)
         self.db.add_message(self.current_phone, "out", text, meta={"channel":"sms","status":status,"msg_id":msg_id})
         self.input.set("")
-        self.load_msgs(self.current_conv_id)
-        self.refresh_convs()
+        self._schedule("msgs", "convs")
 
     def sim_inbound(self):
         dlg = tk.Toplevel(self)
-        dlg.title(tr(self.lang(),"simulate_in"))
+        dlg.title(self.T["simulate_in"])
         dlg.geometry("520x260")
         dlg.transient(self)
         dlg.grab_set()
@@ -319,7 +555,7 @@ class ChatView(ttk.Frame):
         phone_var = tk.StringVar(value=self.current_phone or "0210000000")
         msg_var = tk.StringVar(value="我想预约明天 14:30，到XXX地址，电话0211234567。")
 
-        ttk.Label(dlg, text=tr(self.lang(),"phone")).pack(anchor="w", padx=12, pady=(12,2))
+        ttk.Label(dlg, text=self.T["phone"]).pack(anchor="w", padx=12, pady=(12,2))
         ttk.Entry(dlg, textvariable=phone_var).pack(fill="x", padx=12)
 
         ttk.Label(dlg, text="Message").pack(anchor="w", padx=12, pady=(10,2))
@@ -330,16 +566,17 @@ class ChatView(ttk.Frame):
             msg = msg_var.get().strip()
             if not phone or not msg:
                 return
-            self.db.add_message(phone, "in", msg, meta={"channel":"sms","status":"received"})
-            self._maybe_handle_staff_incoming(phone, msg)
-            self.refresh_convs()
-            # auto select
-            self.conv_list.selection_clear(0, tk.END)
-            for i, r in enumerate(self.conv_rows):
-                if r["phone"] == phone:
+            with self.db.batch():
+                self.db.add_message(phone, "in", msg, meta={"channel":"sms","status":"received"})
+                self._maybe_handle_staff_incoming(phone, msg)
+            def select_new():
+                # auto select
+                self.conv_list.selection_clear(0, tk.END)
+                i = self._phone_to_idx.get(phone)
+                if i is not None:
                     self.conv_list.selection_set(i)
-                    break
-            self.on_select_conv()
+                self.on_select_conv()
+            self.refresh_convs(on_done=select_new)
             dlg.destroy()
 
         ttk.Button(dlg, text="OK", command=do_it).pack(pady=12)
@@ -354,19 +591,29 @@ class ChatView(ttk.Frame):
             req_id = self.db.create_staff_request(staff_id, leave["content"], leave.get("start_time"), leave.get("end_time"))
             self.db.add_message(phone, "sys", f"已收到请假申请（ID {req_id}），等待管理员处理。", meta={"channel":"sys"})
 
+    def close(self):
+        if self._llm is not None:
+            self._llm.close()
+
     def _router(self) -> LLMRouter:
+        # one router per LLM config: keeps its pooled connections, reply cache and breaker across replies
         s = self.db.get_settings()
-        return LLMRouter(LLMConfig(
+        cfg = LLMConfig(
             mode=s.get("llm_mode","local_first"),
             ollama_base_url=s.get("ollama_base_url","http://localhost:11434"),
             ollama_model=s.get("ollama_model","llama3.1:8b"),
             cloud_base_url=s.get("cloud_base_url","https://api.openai.com"),
             cloud_api_key=s.get("cloud_api_key",""),
             cloud_model=s.get("cloud_model","gpt-4o-mini"),
-        ))
+        )
+        if self._llm is None or self._llm.cfg != cfg:
+            if self._llm is not None:
+                self._llm.close()
+            self._llm = LLMRouter(cfg)
+        return self._llm
 
     def ai_reply_once(self):
-        if not self.current_conv_id:
+        if not self.current_conv_id or self._reply_pending:
             return
         conv = self.db.get_conversation(self.current_conv_id)
         if not conv:
@@ -389,20 +636,54 @@ class ChatView(ttk.Frame):
                 last_user = m["text"]
                 break
 
-        kb_ctx = pick_kb_context(last_user, self.db.list_kb(q=last_user))
+        kb_ctx = kb_context(self.db, last_user)
         system = {"role":"system","content":"你是短信接待与派单助手。回复尽量短：确认时间、地址、联系电话、需求。缺什么就问一句。"}
-        ok, out = self._router().chat([system] + kb_ctx + history)
-        if not ok or not out:
+        # the reply streams on a worker thread (the Tk loop keeps handling input);
+        # each queued step is the whole reply so far ("" if a backend failed mid-reply),
+        # None marks the end
+        stream = self._router().chat_stream([system] + kb_ctx + history)
+        steps: queue.Queue = queue.Queue()
+
+        def run():
+            try:
+                for out in stream:
+                    steps.put(out)
+            finally:
+                steps.put(None)
+        self._set_reply_pending(True)
+        threading.Thread(target=run, name="ai-reply", daemon=True).start()
+        # the reply goes to the conversation it was written for, even if the selection moves
+        self.after(DB_POLL_MS, self._drain_reply, steps, self.current_phone, "")
+
+    def _drain_reply(self, steps: queue.Queue, phone: str, out: str):
+        try:
+            while True:
+                step = steps.get_nowait()
+                if step is None:
+                    break
+                out = step
+        except queue.Empty:
+            self.set_status(f"AI: {out[-60:]}")
+            self.after(DB_POLL_MS, self._drain_reply, steps, phone, out)
+            return
+        self._set_reply_pending(False)
+        out = out.strip()
+        if not out:
             out = "收到～麻烦补充：时间、地址、联系电话、以及具体要求。"
-        self._send_text(out)
+        self._send_text(out, phone)
 
-    def _send_text(self, text: str):
-        if not self.current_phone:
+    def _set_reply_pending(self, pending: bool):
+        self._reply_pending = pending
+        for b in (self.ai_btn, self.send_btn):
+            b.state(["disabled"] if pending else ["!disabled"])
+
+    def _send_text(self, text: str, phone: str = ""):
+        phone = phone or self.current_phone
+        if not phone:
             return
-        ok, status, msg_id = self._sms_gateway().send_sms(self.current_phone, text)
-        self.db.add_message(self.current_phone, "out", text, meta={"channel":"sms","status":status,"msg_id":msg_id})
-        self.load_msgs(self.current_conv_id)
-        self.refresh_convs()
+        ok, status, msg_id = self._sms_gateway().send_sms(phone, text)
+        self.db.add_message(phone, "out", text, meta={"channel":"sms","status":status,"msg_id":msg_id})
+        self._schedule("msgs", "convs")
 
     def make_task_from_chat(self):
         if not self.current_conv_id:
@@ -429,33 +710,51 @@ class ChatView(ttk.Frame):
     def refresh_task_panel(self):
         if not self.current_conv_id:
             return
-        task = self.db.get_active_task_for_conv(self.current_conv_id)
+        conv_id = self.current_conv_id
+        if self._staff_version != self.db.staff_version():
+            self.refresh_staff()  # staff edited in StaffView since the name cache was built
+        self._task_token = self._task_state()
+        self._bg("task", self.db.get_active_task_for_conv, conv_id,
+                 apply=lambda task: self._render_task(conv_id, task),
+                 on_error=lambda e: self._task_failed(conv_id, e))
+
+    def _render_task(self, conv_id: int, task):
+        if conv_id != self.current_conv_id:
+            return
+        T = self.T
         self.current_task_id = task["id"] if task else None
+        self._set_task_btns(True)
 
-        self.task_info.config(state="normal")
-        self.task_info.delete("1.0", tk.END)
         if not task:
-            self.task_info.insert(tk.END, "暂无任务：点“从聊天生成任务”。")
+            self.task_info.configure(text="暂无任务：点“从聊天生成任务”。")
         else:
             staff_name = ""
             if task.get("staff_id"):
-                for s in self.db.list_staff(include_inactive=True):
-                    if int(s["id"]) == int(task["staff_id"]):
-                        staff_name = s["name"]
-                        break
+                staff_name = self._staff_name_cache.get(int(task["staff_id"]), "")
             lines = [
-                f"{tr(self.lang(),'status')}：{task.get('status','')}",
-                f"{tr(self.lang(),'title')}：{task.get('title','')}",
-                f"{tr(self.lang(),'phone')}：{task.get('contact_phone','')}",
-                f"{tr(self.lang(),'address')}：{task.get('address','')}",
-                f"{tr(self.lang(),'start_time')}：{(task.get('start_time') or '').replace('T',' ')}",
-                f"{tr(self.lang(),'staff')}：{staff_name}",
-                f"{tr(self.lang(),'notes')}：{(task.get('notes','') or '')[:140]}",
+                f"{T['status']}：{task.get('status','')}",
+                f"{T['title']}：{task.get('title','')}",
+                f"{T['phone']}：{task.get('contact_phone','')}",
+                f"{T['address']}：{task.get('address','')}",
+                f"{T['start_time']}：{(task.get('start_time') or '').replace('T',' ')}",
+                f"{T['staff']}：{staff_name}",
+                f"{T['notes']}：{(task.get('notes','') or '')[:140]}",
             ]
-            self.task_info.insert(tk.END, "\n".join(lines))
+            self.task_info.configure(text="\n".join(lines))
             if task.get("start_time"):
                 self.start_var.set(task["start_time"].replace("T"," "))
-        self.task_info.config(state="disabled")
+
+    def _task_failed(self, conv_id: int, e: BaseException):
+        # lookup failed: show nothing actionable, but don't leave the buttons stuck disabled
+        if conv_id != self.current_conv_id:
+            return
+        self.current_task_id = None
+        self.task_info.configure(text=f"任务读取失败：{e}")
+        self._set_task_btns(True)
+
+    def _set_task_btns(self, enabled: bool):
+        for b in self._task_btns:
+            b.state(["!disabled"] if enabled else ["disabled"])
 
     def _parse_staff_id(self):
         v = self.staff_var.get().strip()
@@ -473,10 +772,10 @@ class ChatView(ttk.Frame):
         staff_id = self._parse_staff_id()
         dt = parse_friendly_dt(self.start_var.get())
         if not staff_id or not dt:
-            messagebox.showinfo("提示", tr(self.lang(),"hint_time"))
+            messagebox.showinfo("提示", self.T["hint_time"])
             return
         start_iso = dt_to_iso(dt)
-        dur = _safe_int(self.dur_var.get(), 60)
+        dur = _safe_int(self.dur_entry.get(), 60)
         hold_minutes = _safe_int(self.db.get_setting("hold_minutes"), 10)
         ok, msg = self.db.assign_hold(self.current_task_id, staff_id, start_iso, dur, hold_minutes)
         if not ok:
@@ -506,16 +805,13 @@ class ChatView(ttk.Frame):
             self.refresh_task_panel()
             self.set_status("CANCELLED")
 
-class ScheduleView(ttk.Frame):
+class ScheduleView(_View):
     def __init__(self, master: tk.Misc, db: DB, get_lang):
-        super().__init__(master)
-        self.db = db
-        self.get_lang = get_lang
+        super().__init__(master, db, get_lang)
+        self._tree_rows: list[tuple] | None = None
         self._build()
         self.refresh()
 
-    def lang(self): return self.get_lang()
-
     def _build(self):
         top = ttk.Frame(self)
         top.pack(fill="x", padx=8, pady=8)
@@ -523,12 +819,12 @@ class ScheduleView(ttk.Frame):
         self.date_var = tk.StringVar(value=datetime.now().strftime("%Y-%m-%d"))
         ttk.Entry(top, textvariable=self.date_var, width=12).pack(side="left", padx=6)
 
-        ttk.Label(top, text=tr(self.lang(),"staff")).pack(side="left", padx=(12,2))
+        self._tr(ttk.Label(top), "staff").pack(side="left", padx=(12,2))
         self.staff_var = tk.StringVar(value="all")
         self.staff_cb = ttk.Combobox(top, textvariable=self.staff_var, state="readonly")
         self.staff_cb.pack(side="left", padx=6)
 
-        ttk.Button(top, text=tr(self.lang(),"refresh"), command=self.refresh).pack(side="right")
+        self._tr(ttk.Button(top, command=self.refresh), "refresh").pack(side="right")
 
         self.tree = ttk.Treeview(self, columns=("time","staff","status","title"), show="headings")
         for c, txt, w in [("time","Time",170),("staff","Staff",140),("status","Status",110),("title","Title",520)]:
@@ -554,29 +850,25 @@ class ScheduleView(ttk.Frame):
             except Exception: sid = None
 
         rows = self.db.list_tasks(date_prefix=date_prefix, staff_id=sid, status="")
+        name_by_id = {int(s["id"]): s["name"] for s in staff}
+        values = [((r.get("start_time") or "").replace("T"," "),
+                   name_by_id.get(int(r["staff_id"]), "") if r.get("staff_id") else "",
+                   r.get("status",""), r.get("title",""))
+                  for r in rows]
+        if values == self._tree_rows:
+            return
+        self._tree_rows = values
         self.tree.delete(*self.tree.get_children())
-        for r in rows:
-            staff_name = ""
-            if r.get("staff_id"):
-                for s in staff:
-                    if int(s["id"]) == int(r["staff_id"]):
-                        staff_name = s["name"]
-                        break
-            self.tree.insert("", "end", values=((r.get("start_time") or "").replace("T"," "),
-                                                staff_name, r.get("status",""), r.get("title","")))
-
-class StaffView(ttk.Frame):
+        _tree_fill(self.tree, values)
+
+class StaffView(_View):
     def __init__(self, master: tk.Misc, db: DB, get_lang):
-        super().__init__(master)
-        self.db = db
-        self.get_lang = get_lang
+        super().__init__(master, db, get_lang)
         self.staff_id = None
         self.req_id = None
         self._build()
         self.refresh()
 
-    def lang(self): return self.get_lang()
-
     def _build(self):
         paned = ttk.PanedWindow(self, orient="horizontal")
         paned.pack(fill="both", expand=True, padx=8, pady=8)
@@ -586,10 +878,10 @@ class StaffView(ttk.Frame):
 
         top = ttk.Frame(left)
         top.pack(fill="x", pady=6)
-        ttk.Button(top, text=tr(self.lang(),"new"), command=self.new_staff).pack(side="left")
-        ttk.Button(top, text=tr(self.lang(),"save"), command=self.save_staff).pack(side="left", padx=6)
-        ttk.Button(top, text=tr(self.lang(),"delete"), command=self.delete_staff).pack(side="left", padx=6)
-        ttk.Button(top, text=tr(self.lang(),"refresh"), command=self.refresh).pack(side="right")
+        self._tr(ttk.Button(top, command=self.new_staff), "new").pack(side="left")
+        self._tr(ttk.Button(top, command=self.save_staff), "save").pack(side="left", padx=6)
+        self._tr(ttk.Button(top, command=self.delete_staff), "delete").pack(side="left", padx=6)
+        self._tr(ttk.Button(top, command=self.refresh), "refresh").pack(side="right")
 
         body = ttk.Frame(left)
         body.pack(fill="both", expand=True)
@@ -609,17 +901,17 @@ class StaffView(ttk.Frame):
         self.phone_var = tk.StringVar()
         self.active_var = tk.IntVar(value=1)
 
-        ttk.Label(editor, text=tr(self.lang(),"name")).pack(anchor="w")
+        self._tr(ttk.Label(editor), "name").pack(anchor="w")
         ttk.Entry(editor, textvariable=self.name_var).pack(fill="x", pady=(0,8))
 
-        ttk.Label(editor, text=tr(self.lang(),"phone")).pack(anchor="w")
+        self._tr(ttk.Label(editor), "phone").pack(anchor="w")
         ttk.Entry(editor, textvariable=self.phone_var).pack(fill="x", pady=(0,8))
 
-        ttk.Checkbutton(editor, text=tr(self.lang(),"active"), variable=self.active_var).pack(anchor="w", pady=(0,8))
+        self._tr(ttk.Checkbutton(editor, variable=self.active_var), "active").pack(anchor="w", pady=(0,8))
 
         right = ttk.Frame(paned)
         paned.add(right, weight=3)
-        ttk.Label(right, text=tr(self.lang(),"leave_requests")).pack(anchor="w")
+        self._tr(ttk.Label(right), "leave_requests").pack(anchor="w")
 
         self.req_tree = ttk.Treeview(right, columns=("id","staff","status","time","content"), show="headings")
         for c, txt, w in [("id","ID",60),("staff","Staff",120),("status","Status",110),("time","Time",160),("content","Content",360)]:
@@ -630,8 +922,8 @@ class StaffView(ttk.Frame):
 
         ops = ttk.Frame(right)
         ops.pack(fill="x")
-        ttk.Button(ops, text=tr(self.lang(),"approve"), command=lambda: self.set_req_status("APPROVED")).pack(side="left")
-        ttk.Button(ops, text=tr(self.lang(),"reject"), command=lambda: self.set_req_status("REJECTED")).pack(side="left", padx=6)
+        self._tr(ttk.Button(ops, command=lambda: self.set_req_status("APPROVED")), "approve").pack(side="left")
+        self._tr(ttk.Button(ops, command=lambda: self.set_req_status("REJECTED")), "reject").pack(side="left", padx=6)
 
     def on_show(self):
         self.refresh()
@@ -640,9 +932,9 @@ class StaffView(ttk.Frame):
         rows = self.db.list_staff(include_inactive=True)
         self.staff_rows = rows
         self.staff_list.delete(0, tk.END)
-        for r in rows:
-            tag = "" if r.get("active") else " (off)"
-            self.staff_list.insert(tk.END, f"{r['id']}: {r['name']} {r['phone']}{tag}")
+        items = [f"{r['id']}: {r['name']} {r['phone']}{'' if r.get('active') else ' (off)'}" for r in rows]
+        if items:
+            self.staff_list.insert(tk.END, *items)
 
         self.refresh_requests()
 
@@ -686,10 +978,11 @@ class StaffView(ttk.Frame):
         reqs = self.db.list_staff_requests(status="")
         staff_map = {s["id"]: s["name"] for s in self.staff_rows}
         self.req_rows = reqs
+        values = [(r["id"], staff_map.get(r["staff_id"], str(r["staff_id"])), r["status"],
+                   (r["created_time"] or "").replace("T"," "), (r["content"] or "")[:80])
+                  for r in reqs]
         self.req_tree.delete(*self.req_tree.get_children())
-        for r in reqs:
-            staff_name = staff_map.get(r["staff_id"], str(r["staff_id"]))
-            self.req_tree.insert("", "end", values=(r["id"], staff_name, r["status"], (r["created_time"] or "").replace("T"," "), (r["content"] or "")[:80]))
+        _tree_fill(self.req_tree, values)
 
     def on_select_req(self):
         sel = self.req_tree.selection()
@@ -705,105 +998,128 @@ class StaffView(ttk.Frame):
         self.db.update_staff_request_status(self.req_id, status)
         self.refresh_requests()
 
-class MeView(ttk.Frame):
+class MeView(_View):
     def __init__(self, master: tk.Misc, db: DB, get_lang, on_lang_changed):
-        super().__init__(master)
-        self.db = db
-        self.get_lang = get_lang
+        super().__init__(master, db, get_lang)
         self.on_lang_changed = on_lang_changed
         self.kb_id = None
+        # bumped whenever the editor switches entry (New/select), so a save that
+        # lands afterwards can tell it no longer owns the editor
+        self._kb_gen = 0
+        self._kb_after_id: str | None = None
+        # list_kb rows by id (the kb_tree iid)
+        self.kb_rows: dict[int, dict] = {}
+        # (id, row values) per item currently in kb_tree, in display order
+        self._kb_display: list[tuple[int,tuple]] = []
+        self._kb_more = False      # last fetch filled its page: there may be more rows
+        self._kb_paging = False    # a load-more is already queued
+        # content still to be streamed into kb_content: (text, next offset, after id)
+        self._kb_stream: tuple[str, int, str] | None = None
+        self._kb_built = False     # KB tab widgets are created on first selection
         self._build()
         self.load_settings()
-        self.refresh_kb()
-
-    def lang(self): return self.get_lang()
 
     def _build(self):
-        nb = ttk.Notebook(self)
+        nb = self.nb = ttk.Notebook(self)
         nb.pack(fill="both", expand=True, padx=8, pady=8)
 
         self.tab_settings = ttk.Frame(nb)
         self.tab_kb = ttk.Frame(nb)
-        nb.add(self.tab_settings, text=tr(self.lang(),"settings"))
-        nb.add(self.tab_kb, text=tr(self.lang(),"kb"))
+        nb.add(self.tab_settings)
+        nb.add(self.tab_kb)
+        self._tr_apply(lambda text: nb.tab(self.tab_settings, text=text), "settings")
+        self._tr_apply(lambda text: nb.tab(self.tab_kb, text=text), "kb")
+        self._build_settings_tab()
+        nb.bind("<<NotebookTabChanged>>", lambda e: self._on_tab_changed())
+
+    def _on_tab_changed(self):
+        if self._kb_built or self.nb.select() != str(self.tab_kb):
+            return
+        self._kb_built = True
+        self._build_kb_tab()
+        self.refresh_kb()
 
-        # settings
+    def _build_settings_tab(self):
         f = self.tab_settings
         pad = {"padx":10, "pady":8}
         row = 0
 
-        ttk.Label(f, text=tr(self.lang(),"language")).grid(row=row, column=0, sticky="w", **pad)
-        self.lang_var = tk.StringVar()
-        ttk.Combobox(f, textvariable=self.lang_var, state="readonly", values=["zh","en"]).grid(row=row, column=1, sticky="we", **pad)
+        self._tr(ttk.Label(f), "language").grid(row=row, column=0, sticky="w", **pad)
+        self.lang_box = ttk.Combobox(f, state="readonly", values=["zh","en"])
+        self.lang_box.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
-        ttk.Label(f, text=tr(self.lang(),"sms_mode")).grid(row=row, column=0, sticky="w", **pad)
-        self.sms_var = tk.StringVar()
-        ttk.Combobox(f, textvariable=self.sms_var, state="readonly", values=["simulator","off"]).grid(row=row, column=1, sticky="we", **pad)
+        self._tr(ttk.Label(f), "sms_mode").grid(row=row, column=0, sticky="w", **pad)
+        self.sms_box = ttk.Combobox(f, state="readonly", values=["simulator","off"])
+        self.sms_box.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
-        ttk.Label(f, text=tr(self.lang(),"llm_mode")).grid(row=row, column=0, sticky="w", **pad)
-        self.llm_var = tk.StringVar()
-        ttk.Combobox(f, textvariable=self.llm_var, state="readonly", values=["local_first","cloud_first","off"]).grid(row=row, column=1, sticky="we", **pad)
+        self._tr(ttk.Label(f), "llm_mode").grid(row=row, column=0, sticky="w", **pad)
+        self.llm_box = ttk.Combobox(f, state="readonly", values=["local_first","cloud_first","off"])
+        self.llm_box.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
         ttk.Label(f, text="Ollama URL").grid(row=row, column=0, sticky="w", **pad)
-        self.ollama_url = tk.StringVar()
-        ttk.Entry(f, textvariable=self.ollama_url).grid(row=row, column=1, sticky="we", **pad)
+        self.ollama_url_entry = ttk.Entry(f)
+        self.ollama_url_entry.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
         ttk.Label(f, text="Ollama Model").grid(row=row, column=0, sticky="w", **pad)
-        self.ollama_model = tk.StringVar()
-        ttk.Entry(f, textvariable=self.ollama_model).grid(row=row, column=1, sticky="we", **pad)
+        self.ollama_model_entry = ttk.Entry(f)
+        self.ollama_model_entry.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
         ttk.Label(f, text="Cloud API Key").grid(row=row, column=0, sticky="w", **pad)
-        self.cloud_key = tk.StringVar()
-        ttk.Entry(f, textvariable=self.cloud_key, show="*").grid(row=row, column=1, sticky="we", **pad)
+        self.cloud_key_entry = ttk.Entry(f, show="*")
+        self.cloud_key_entry.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
         ttk.Label(f, text="Cloud Model").grid(row=row, column=0, sticky="w", **pad)
-        self.cloud_model = tk.StringVar()
-        ttk.Entry(f, textvariable=self.cloud_model).grid(row=row, column=1, sticky="we", **pad)
+        self.cloud_model_entry = ttk.Entry(f)
+        self.cloud_model_entry.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
         ttk.Label(f, text="HOLD minutes").grid(row=row, column=0, sticky="w", **pad)
-        self.hold_var = tk.StringVar()
-        ttk.Entry(f, textvariable=self.hold_var).grid(row=row, column=1, sticky="we", **pad)
+        self.hold_entry = ttk.Entry(f)
+        self.hold_entry.grid(row=row, column=1, sticky="we", **pad)
         row += 1
 
         btns = ttk.Frame(f)
         btns.grid(row=row, column=0, columnspan=2, sticky="we", padx=10, pady=16)
-        ttk.Button(btns, text=tr(self.lang(),"save"), command=self.save_settings).pack(side="left")
+        self._tr(ttk.Button(btns, command=self.save_settings), "save").pack(side="left")
         ttk.Label(btns, text="Data folder: user_data/").pack(side="left", padx=12)
 
         f.columnconfigure(1, weight=1)
 
-        # KB tab
+    def _build_kb_tab(self):
         k = self.tab_kb
         top = ttk.Frame(k)
         top.pack(fill="x", padx=8, pady=8)
 
-        ttk.Label(top, text=tr(self.lang(),"search")).pack(side="left")
+        self._tr(ttk.Label(top), "search").pack(side="left")
         self.kb_q = tk.StringVar()
         ee = ttk.Entry(top, textvariable=self.kb_q, width=28)
         ee.pack(side="left", padx=6)
-        ee.bind("<KeyRelease>", lambda ev: self.refresh_kb())
+        ee.bind("<KeyRelease>", lambda ev: self._schedule_refresh_kb())
 
-        ttk.Button(top, text=tr(self.lang(),"new"), command=self.kb_new).pack(side="left", padx=6)
-        ttk.Button(top, text=tr(self.lang(),"save"), command=self.kb_save).pack(side="left", padx=6)
-        ttk.Button(top, text=tr(self.lang(),"delete"), command=self.kb_delete).pack(side="left", padx=6)
+        self._tr(ttk.Button(top, command=self.kb_new), "new").pack(side="left", padx=6)
+        self.kb_save_btn = self._tr(ttk.Button(top, command=self.kb_save), "save")
+        self.kb_save_btn.pack(side="left", padx=6)
+        self._tr(ttk.Button(top, command=self.kb_delete), "delete").pack(side="left", padx=6)
 
         body = ttk.Frame(k)
         body.pack(fill="both", expand=True, padx=8, pady=8)
 
-        self.kb_list = tk.Listbox(body, activestyle="none")
-        self.kb_list.pack(side="left", fill="both", expand=True)
-        self.kb_list.bind("<<ListboxSelect>>", lambda e: self.kb_load())
+        self.kb_tree = ttk.Treeview(body, columns=("title","enabled"), show="headings", selectmode="browse")
+        for c, txt, w in [("title","Title",220),("enabled","On",50)]:
+            self.kb_tree.heading(c, text=txt)
+            self.kb_tree.column(c, width=w, stretch=(c == "title"))
+        self.kb_tree.pack(side="left", fill="both", expand=True)
+        self.kb_tree.bind("<<TreeviewSelect>>", lambda e: self.kb_load())
 
-        sb = ttk.Scrollbar(body, orient="vertical", command=self.kb_list.yview)
+        sb = ttk.Scrollbar(body, orient="vertical", command=self.kb_tree.yview)
         sb.pack(side="left", fill="y")
-        self.kb_list.config(yscrollcommand=sb.set)
+        self.kb_tree.config(yscrollcommand=lambda first, last: self._kb_scrolled(sb, first, last))
 
         right = ttk.Frame(body)
         right.pack(side="left", fill="both", expand=True, padx=(10,0))
@@ -812,13 +1128,13 @@ class MeView(ttk.Frame):
         self.kb_tags = tk.StringVar()
         self.kb_enabled = tk.IntVar(value=1)
 
-        ttk.Label(right, text=tr(self.lang(),"title")).pack(anchor="w")
+        self._tr(ttk.Label(right), "title").pack(anchor="w")
         ttk.Entry(right, textvariable=self.kb_title).pack(fill="x", pady=(0,8))
 
         ttk.Label(right, text="Tags").pack(anchor="w")
         ttk.Entry(right, textvariable=self.kb_tags).pack(fill="x", pady=(0,8))
 
-        ttk.Checkbutton(right, text=tr(self.lang(),"enabled"), variable=self.kb_enabled).pack(anchor="w", pady=(0,8))
+        self._tr(ttk.Checkbutton(right, variable=self.kb_enabled), "enabled").pack(anchor="w", pady=(0,8))
 
         ttk.Label(right, text="Content").pack(anchor="w")
         self.kb_content = tk.Text(right, height=16, wrap="word")
@@ -826,65 +1142,170 @@ class MeView(ttk.Frame):
 
     def on_show(self):
         self.load_settings()
-        self.refresh_kb()
+        if self._kb_built:
+            self.refresh_kb()
 
     def load_settings(self):
+        # plain widgets, no StringVars: the form is only read back on save
         s = self.db.get_settings()
-        self.lang_var.set(s.get("lang","zh"))
-        self.sms_var.set(s.get("sms_mode","simulator"))
-        self.llm_var.set(s.get("llm_mode","local_first"))
-        self.ollama_url.set(s.get("ollama_base_url","http://localhost:11434"))
-        self.ollama_model.set(s.get("ollama_model","llama3.1:8b"))
-        self.cloud_key.set(s.get("cloud_api_key",""))
-        self.cloud_model.set(s.get("cloud_model","gpt-4o-mini"))
-        self.hold_var.set(s.get("hold_minutes","10"))
+        _entry_set(self.lang_box, s.get("lang","zh"))
+        _entry_set(self.sms_box, s.get("sms_mode","simulator"))
+        _entry_set(self.llm_box, s.get("llm_mode","local_first"))
+        _entry_set(self.ollama_url_entry, s.get("ollama_base_url","http://localhost:11434"))
+        _entry_set(self.ollama_model_entry, s.get("ollama_model","llama3.1:8b"))
+        _entry_set(self.cloud_key_entry, s.get("cloud_api_key",""))
+        _entry_set(self.cloud_model_entry, s.get("cloud_model","gpt-4o-mini"))
+        _entry_set(self.hold_entry, s.get("hold_minutes","10"))
 
     def save_settings(self):
-        self.db.set_setting("lang", self.lang_var.get().strip() or "zh")
-        self.db.set_setting("sms_mode", self.sms_var.get().strip() or "simulator")
-        self.db.set_setting("llm_mode", self.llm_var.get().strip() or "local_first")
-        self.db.set_setting("ollama_base_url", self.ollama_url.get().strip())
-        self.db.set_setting("ollama_model", self.ollama_model.get().strip())
-        self.db.set_setting("cloud_api_key", self.cloud_key.get().strip())
-        self.db.set_setting("cloud_model", self.cloud_model.get().strip())
-        self.db.set_setting("hold_minutes", self.hold_var.get().strip() or "10")
+        self.db.set_settings({
+            "lang": self.lang_box.get().strip() or "zh",
+            "sms_mode": self.sms_box.get().strip() or "simulator",
+            "llm_mode": self.llm_box.get().strip() or "local_first",
+            "ollama_base_url": self.ollama_url_entry.get().strip(),
+            "ollama_model": self.ollama_model_entry.get().strip(),
+            "cloud_api_key": self.cloud_key_entry.get().strip(),
+            "cloud_model": self.cloud_model_entry.get().strip(),
+            "hold_minutes": self.hold_entry.get().strip() or "10",
+        })
         messagebox.showinfo("OK", "Saved")
         self.on_lang_changed()
 
     # KB
+    def _schedule_refresh_kb(self):
+        # debounce: one query per typing pause
+        if self._kb_after_id:
+            self.after_cancel(self._kb_after_id)
+        self._kb_after_id = self.after(KB_SEARCH_DEBOUNCE_MS, self._do_refresh_kb)
+
+    def _do_refresh_kb(self):
+        self._kb_after_id = None
+        self.refresh_kb()
+
     def refresh_kb(self):
-        rows = self.db.list_kb(self.kb_q.get())
-        self.kb_rows = rows
-        self.kb_list.delete(0, tk.END)
-        for r in rows:
-            flag = "" if r.get("enabled") else " (off)"
-            self.kb_list.insert(tk.END, f"{r.get('title','')}{flag}")
+        # re-fetch as many rows as are loaded now, so saving doesn't collapse the pages
+        limit = max(KB_PAGE_SIZE, len(self._kb_display))
+        rows = self.db.list_kb(self.kb_q.get(), limit=limit)
+        self.kb_rows = {r["id"]: r for r in rows}
+        self._kb_more = len(rows) == limit
+        new = [(r["id"], (r["title"], r["flag"])) for r in rows]
+        old = self._kb_display
+        if new == old:
+            return
+        # replace only the middle slice between the common prefix and common suffix
+        n = min(len(new), len(old))
+        pre = 0
+        while pre < n and new[pre] == old[pre]:
+            pre += 1
+        suf = 0
+        while suf < n - pre and new[-1 - suf] == old[-1 - suf]:
+            suf += 1
+        # ids are unique per list, so the middle's iids are free again once it's deleted
+        if len(old) - suf > pre:
+            self.kb_tree.delete(*(kid for kid, _ in old[pre:len(old) - suf]))
+        if len(new) - suf > pre:
+            _tree_insert(self.kb_tree, pre, new[pre:len(new) - suf])
+        self._kb_display = new
+
+    def _kb_scrolled(self, sb: ttk.Scrollbar, first: str, last: str):
+        sb.set(first, last)
+        # near the bottom: fetch the next page once the current redraw is done
+        if self._kb_more and not self._kb_paging and float(last) > 0.9:
+            self._kb_paging = True
+            self.after_idle(self._kb_load_more)
+
+    def _kb_load_more(self):
+        self._kb_paging = False
+        rows = self.db.list_kb(self.kb_q.get(), offset=len(self._kb_display))
+        self._kb_more = len(rows) == KB_PAGE_SIZE
+        if not rows:
+            return
+        # an edit between pages can shift a row we already show into this one
+        more = [(r["id"], (r["title"], r["flag"])) for r in rows if r["id"] not in self.kb_rows]
+        self.kb_rows.update((r["id"], r) for r in rows)
+        self._kb_display = self._kb_display + more
+        _tree_insert(self.kb_tree, "end", more)
 
     def kb_new(self):
+        self._kb_gen += 1
         self.kb_id = None
         self.kb_title.set("")
         self.kb_tags.set("")
         self.kb_enabled.set(1)
+        self._kb_stop_stream()
         self.kb_content.delete("1.0", tk.END)
 
     def kb_load(self):
-        sel = self.kb_list.curselection()
+        sel = self.kb_tree.selection()
         if not sel: return
+        self._kb_gen += 1
+        # list_kb rows always carry every kb_entries column (all NOT NULL)
         r = self.kb_rows[int(sel[0])]
-        self.kb_id = int(r["id"])
-        self.kb_title.set(r.get("title",""))
-        self.kb_tags.set(r.get("tags",""))
-        self.kb_enabled.set(1 if r.get("enabled") else 0)
+        self.kb_id = r["id"]
+        self.kb_title.set(r["title"])
+        self.kb_tags.set(r["tags"])
+        self.kb_enabled.set(1 if r["enabled"] else 0)
+        self._kb_set_content(r["content"])
+
+    def _kb_set_content(self, content: str):
+        self._kb_stop_stream()
         self.kb_content.delete("1.0", tk.END)
-        self.kb_content.insert(tk.END, r.get("content",""))
+        if len(content) <= KB_STREAM_MIN:
+            self.kb_content.insert(tk.END, content)
+            return
+        # big entry: first chunk now, the rest between events; read-only until complete
+        self.kb_content.insert(tk.END, content[:KB_STREAM_CHUNK])
+        self.kb_content.config(state="disabled")
+        self._kb_stream = (content, KB_STREAM_CHUNK, self.after_idle(self._kb_stream_next))
+
+    def _kb_stream_next(self):
+        content, pos, _ = self._kb_stream
+        self.kb_content.config(state="normal")
+        self.kb_content.insert(tk.END, content[pos:pos + KB_STREAM_CHUNK])
+        pos += KB_STREAM_CHUNK
+        if pos < len(content):
+            self.kb_content.config(state="disabled")
+            self._kb_stream = (content, pos, self.after_idle(self._kb_stream_next))
+        else:
+            self._kb_stream = None
+
+    def _kb_stop_stream(self, finish: bool = False):
+        # finish=True: insert whatever is left right away (e.g. before saving)
+        if self._kb_stream is None:
+            return
+        content, pos, after_id = self._kb_stream
+        self._kb_stream = None
+        self.after_cancel(after_id)
+        self.kb_content.config(state="normal")
+        if finish:
+            self.kb_content.insert(tk.END, content[pos:])
 
     def kb_save(self):
+        self._kb_stop_stream(finish=True)
         title = self.kb_title.get().strip()
         content = self.kb_content.get("1.0", tk.END).strip()
         if not title or not content:
             messagebox.showwarning("提示", "标题和内容不能为空")
             return
-        self.kb_id = self.db.upsert_kb(self.kb_id, title, content, self.kb_tags.get(), int(self.kb_enabled.get()))
+        # the write runs on the DB's write thread; Save stays disabled until it lands
+        self.kb_save_btn.state(["disabled"])
+        fut = self.db.submit_write(self.db.upsert_kb, self.kb_id, title, content,
+                                   self.kb_tags.get(), int(self.kb_enabled.get()))
+        self.after(DB_POLL_MS, self._kb_check_save, fut, self._kb_gen)
+
+    def _kb_check_save(self, fut, gen: int):
+        if not fut.done():
+            self.after(DB_POLL_MS, self._kb_check_save, fut, gen)
+            return
+        self.kb_save_btn.state(["!disabled"])
+        try:
+            saved_id = fut.result()
+        except Exception as e:
+            messagebox.showerror("错误", f"保存失败：{e}")
+            return
+        # only adopt the new id if the editor still shows the entry that was saved
+        if self._kb_gen == gen:
+            self.kb_id = saved_id
         self.refresh_kb()
         messagebox.showinfo("OK", "Saved")
 